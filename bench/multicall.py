@@ -0,0 +1,149 @@
+"""Compare CPU cost per vault of building and decoding the vault scan multicall: web3's ABI codec vs calls.
+
+Usage:
+    python bench/multicall.py
+    python bench/multicall.py --vaults 5000
+"""
+
+import argparse
+import random
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from eth_abi.abi import encode  # noqa: E402
+from web3 import Web3  # noqa: E402
+
+from calls import (  # noqa: E402
+    ASSET,
+    DECIMALS,
+    GET_STRATEGY_APR,
+    NAME,
+    TOTAL_ASSETS,
+    VAULT_INFO,
+    address_word,
+    decode_address,
+    decode_aggregate3,
+    decode_string,
+    decode_uint,
+    encode_aggregate3,
+    word,
+)
+from utils import load_abi  # noqa: E402
+
+REGISTRY = "0xd40ecF29e001c76Dcc4cC0D9cd50520CE845B038"
+APR_ORACLE = "0x1981AD9F44F2EA9aDd2dC4AD7D075c102C70aF92"
+
+
+def synthetic_vaults(n: int) -> list[str]:
+    rng = random.Random(0)
+    return [Web3.to_checksum_address("%040x" % rng.getrandbits(160)) for _ in range(n)]
+
+
+def response(vaults: list[str]) -> bytes:
+    """aggregate3 return data for the scan calls of vaults, all successful."""
+    results = []
+    for i, vault in enumerate(vaults):
+        results += [
+            (True, encode(["address", "uint256", "uint256", "uint256"], [REGISTRY, 1, 1, 0])),
+            (True, encode(["string"], [f"USDC-{i} yVault"])),
+            (True, encode(["address"], [vault])),
+            (True, encode(["uint8"], [6])),
+            (True, encode(["uint256"], [10**12 + i])),
+            (True, encode(["uint256"], [5 * 10**16])),
+        ]
+    return encode(["(bool,bytes)[]"], [results])
+
+
+def scan_web3(vaults: list[str], data: bytes) -> list[dict[str, Any]]:
+    w3 = Web3()
+    registry = w3.eth.contract(abi=load_abi("registry"))
+    vault_contract = w3.eth.contract(abi=load_abi("vault"))
+    oracle = w3.eth.contract(abi=load_abi("apr_oracle"))
+    multicall = w3.eth.contract(abi=load_abi("multicall3"))
+    calls = []
+    for vault in vaults:
+        calls += [
+            (REGISTRY, registry.encode_abi("vaultInfo", args=[vault])),
+            (vault, vault_contract.encode_abi("name")),
+            (vault, vault_contract.encode_abi("asset")),
+            (vault, vault_contract.encode_abi("decimals")),
+            (vault, vault_contract.encode_abi("totalAssets")),
+            (APR_ORACLE, oracle.encode_abi("getStrategyApr", args=[vault, 0])),
+        ]
+    multicall.encode_abi("aggregate3", args=[[(Web3.to_checksum_address(t), True, d) for t, d in calls]])
+    results = w3.codec.decode(["(bool,bytes)[]"], data)[0]
+    rows = []
+    for i in range(len(vaults)):
+        info, name, asset, decimals, assets, apr = (r[1] for r in results[6 * i : 6 * i + 6])
+        rows.append(
+            {
+                "vault_type": w3.codec.decode(["address", "uint256", "uint256", "uint256"], info)[2],
+                "name": w3.codec.decode(["string"], name)[0],
+                "asset": w3.codec.decode(["address"], asset)[0].lower(),
+                "decimals": w3.codec.decode(["uint8"], decimals)[0],
+                "amount": w3.codec.decode(["uint256"], assets)[0],
+                "apr": w3.codec.decode(["uint256"], apr)[0],
+            }
+        )
+    return rows
+
+
+def scan_calls(vaults: list[str], data: bytes) -> list[dict[str, Any]]:
+    calls = []
+    for vault in vaults:
+        vault_word = address_word(vault)
+        calls += [
+            (REGISTRY, VAULT_INFO + vault_word),
+            (vault, NAME),
+            (vault, ASSET),
+            (vault, DECIMALS),
+            (vault, TOTAL_ASSETS),
+            (APR_ORACLE, GET_STRATEGY_APR + vault_word + word(0)),
+        ]
+    encode_aggregate3(calls)
+    results = decode_aggregate3(data)
+    rows = []
+    for i in range(len(vaults)):
+        info, name, asset, decimals, assets, apr = (r[1] for r in results[6 * i : 6 * i + 6])
+        rows.append(
+            {
+                "vault_type": decode_uint(info[64:]),
+                "name": decode_string(name),
+                "asset": decode_address(asset),
+                "decimals": decode_uint(decimals),
+                "amount": decode_uint(assets),
+                "apr": decode_uint(apr),
+            }
+        )
+    return rows
+
+
+def measure(fn: Callable[[list[str], bytes], list[dict[str, Any]]], vaults: list[str], data: bytes) -> float:
+    start = time.perf_counter()
+    fn(vaults, data)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vaults", type=int, default=2000, help="synthetic vault count")
+    args = parser.parse_args()
+
+    vaults = synthetic_vaults(args.vaults)
+    data = response(vaults)
+    if scan_web3(vaults, data) != scan_calls(vaults, data):
+        sys.exit("Decoders disagree")
+    print(f"Response: {len(data) / 1e6:.1f} MB for {args.vaults} vaults")
+
+    for label, fn in (("web3", scan_web3), ("calls", scan_calls)):
+        elapsed = measure(fn, vaults, data)
+        print(f"{label:>6}: {elapsed * 1000:8.1f} ms, {elapsed / args.vaults * 1e6:7.1f} us per vault")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""Run the newsletter pipeline offline against a fake JSON-RPC node and a DefiLlama stand-in.
+
+Both servers run locally with synthetic data and a configurable per-request latency. For every vault count,
+each section is fetched cold (fresh data dir, separate process) and generate.generate() runs end to end.
+
+Usage:
+    python bench/pipeline.py                                   # 10, 100, 1000 and 10000 vaults
+    python bench/pipeline.py --vaults 10 500 --latency 50      # 50 ms per request
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.request import urlopen
+
+from eth_abi.abi import decode, encode
+from eth_utils.crypto import keccak
+from protocols import synthetic_payload
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+CHAINS = ["mainnet", "arbitrum", "base", "katana"]
+REGISTRIES = ["0xd40ecf29e001c76dcc4cc0d9cd50520ce845b038", "0xff31a1b020c868f6ea3f61eb953344920eeca3af"]
+
+# Listed assets: a stablecoin and WETH per chain (WETH is a crypto token in vaults.py)
+STABLE = "0x" + "5" * 40
+WETH = {
+    "mainnet": "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
+    "arbitrum": "0x82af49447d8a07e3bd95bd0d56f35241523fbab1",
+    "base": "0x4200000000000000000000000000000000000006",
+    "katana": "0xee7d8bcfb72bc1880d0cf19822eb0a2e6577ab62",
+}
+
+
+def selector(signature: str) -> bytes:
+    return keccak(text=signature)[:4]
+
+
+AGGREGATE3 = selector("aggregate3((address,bool,bytes)[])")
+
+
+def word(data: bytes, offset: int) -> int:
+    return int.from_bytes(data[offset : offset + 32], "big")
+
+
+def decode_aggregate3(args: bytes) -> list[tuple[str, bytes]]:
+    """(target, calldata) of each Call3, decoded by hand: eth_abi would make the fake node the bottleneck."""
+    array = word(args, 0)
+    calls = []
+    for i in range(word(args, array)):
+        call = array + 32 + word(args, array + 32 + 32 * i)
+        target = "0x" + args[call + 12 : call + 32].hex()
+        data = call + word(args, call + 64)
+        calls.append((target, args[data + 32 : data + 32 + word(args, data)]))
+    return calls
+
+
+def encode_results(results: list[tuple[bool, bytes]]) -> bytes:
+    """ABI-encode (bool,bytes)[] for aggregate3's return value."""
+    n = len(results)
+    heads, tails, offset = [], [], 32 * n
+    for success, data in results:
+        heads.append(offset.to_bytes(32, "big"))
+        padded = data + bytes(-len(data) % 32)
+        tails.append(
+            int(success).to_bytes(32, "big") + (64).to_bytes(32, "big") + len(data).to_bytes(32, "big") + padded
+        )
+        offset += len(tails[-1])
+    return (32).to_bytes(32, "big") + n.to_bytes(32, "big") + b"".join(heads) + b"".join(tails)
+
+
+class Stats:
+    """Request and byte counters, shared by a server's handler threads."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def add(self, size: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+
+    def snapshot(self) -> dict[str, int]:
+        with self.lock:
+            return {"requests": self.requests, "bytes": self.bytes}
+
+
+class FakeChain:
+    """Synthetic registry, vault, APR oracle and reward distributor state for one chain."""
+
+    def __init__(self, name: str, vaults: int) -> None:
+        self.name = name
+        index = CHAINS.index(name)
+        self.vaults = [f"0x{index + 1:02x}{i:038x}" for i in range(vaults)]
+        rng = random.Random(name)
+        self.info: dict[str, dict[str, Any]] = {}
+        for i, vault in enumerate(self.vaults):
+            crypto = rng.random() < 0.3
+            self.info[vault] = {
+                "type": 1 if rng.random() < 0.8 else 2,
+                "name": f"{'WETH' if crypto else 'USDC'}-{i} yVault",
+                "asset": WETH[name] if crypto else STABLE,
+                "decimals": 18 if crypto else 6,
+                "total_assets": rng.randrange(1, 10**7) * 10 ** (18 if crypto else 6),
+                "apr": rng.randrange(0, 20 * 10**16),
+            }
+        self.calls: dict[bytes, Callable[[str, bytes], bytes]] = {
+            selector("getAllEndorsedVaults()"): self.endorsed,
+            selector("vaultInfo(address)"): self.vault_info,
+            selector("name()"): lambda to, args: encode(["string"], [self.info[to]["name"]]),
+            selector("asset()"): lambda to, args: encode(["address"], [self.info[to]["asset"]]),
+            # Anything that isn't a vault is a USD price feed, with 8 decimals
+            selector("decimals()"): lambda to, args: encode(
+                ["uint8"], [self.info[to]["decimals"] if to in self.info else 8]
+            ),
+            selector("latestRoundData()"): lambda to, args: encode(
+                ["uint80", "int256", "uint256", "uint256", "uint80"], [1, 3000 * 10**8, 0, int(time.time()), 1]
+            ),
+            selector("totalAssets()"): lambda to, args: encode(["uint256"], [self.info[to]["total_assets"]]),
+            selector("getStrategyApr(address,int256)"): self.strategy_apr,
+            selector("pricePerShare()"): lambda to, args: encode(["uint256"], [105 * 10**16]),
+            selector("getWeek()"): lambda to, args: encode(["uint256"], [100]),
+            selector("weeklyRewardAmount(uint256)"): lambda to, args: encode(["uint256"], [10**22]),
+        }
+
+    def endorsed(self, to: str, args: bytes) -> bytes:
+        # Vaults are split evenly across the registries
+        i = REGISTRIES.index(to)
+        return encode(["address[][]"], [[self.vaults[i :: len(REGISTRIES)]]])
+
+    def vault_info(self, to: str, args: bytes) -> bytes:
+        (vault,) = decode(["address"], args)
+        info = self.info[vault.lower()]
+        return encode(
+            ["address", "uint96", "uint64", "uint128", "uint64", "string"], [info["asset"], 3, info["type"], 0, 0, ""]
+        )
+
+    def strategy_apr(self, to: str, args: bytes) -> bytes:
+        vault, _ = decode(["address", "int256"], args)
+        return encode(["uint256"], [self.info[vault.lower()]["apr"]])
+
+    def call(self, to: str, data: bytes) -> bytes:
+        if data[:4] != AGGREGATE3:
+            raise ValueError("only aggregate3 is served")
+        results = []
+        for target, calldata in decode_aggregate3(data[4:]):
+            try:
+                results.append((True, self.calls[calldata[:4]](target, calldata[4:])))
+            except (KeyError, ValueError):
+                results.append((False, b""))
+        return encode_results(results)
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        method, params = request["method"], request.get("params", [])
+        response: dict[str, Any] = {"jsonrpc": "2.0", "id": request.get("id")}
+        if method == "eth_blockNumber":
+            response["result"] = hex(20_000_000)
+        elif method == "eth_chainId":
+            response["result"] = hex(1)
+        elif method == "eth_getBlockByNumber":
+            response["result"] = {"number": params[0], "timestamp": hex(int(time.time()))}
+        elif method == "eth_getLogs":
+            response["result"] = []
+        elif method == "eth_call":
+            try:
+                response["result"] = (
+                    "0x" + self.call(params[0]["to"].lower(), bytes.fromhex(params[0]["data"][2:])).hex()
+                )
+            except Exception as e:
+                response["error"] = {"code": -32000, "message": f"execution reverted: {e}"}
+        else:
+            response["error"] = {"code": -32601, "message": f"{method} not supported"}
+        return response
+
+
+def llama_routes() -> dict[str, bytes]:
+    """Response bodies of the llama endpoints the pipeline reads, by path."""
+    day = 86400
+    start = int(time.time()) // day * day - 2000 * day
+    history = [{"date": start + i * day, "tvl": 8e10 + i * 1e7} for i in range(2001)]
+    return {
+        "/tvl/yearn": b"312345678.9",
+        "/protocols": synthetic_payload(6000),
+        "/v2/historicalChainTvl": json.dumps(history).encode(),
+        "/api/vaults": b"{}",
+    }
+
+
+def prices(path: str) -> bytes:
+    coins = {}
+    for key in path.removeprefix("/prices/current/").split(","):
+        if key == "coingecko:ethereum" or key.endswith(tuple(WETH.values())):
+            coins[key] = {"price": 3000.0}
+        elif key.endswith(STABLE):
+            coins[key] = {"price": 1.0}
+    return json.dumps({"coins": coins}).encode()
+
+
+def serve(handler: type[BaseHTTPRequestHandler]) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_servers(latency: float) -> tuple[str, str, dict[str, Any]]:
+    """Start the RPC and llama servers; state["chains"] and state["llama"] hold the data they serve."""
+    rpc_stats, llama_stats = Stats(), Stats()
+    state: dict[str, Any] = {"chains": {}, "llama": {}}
+
+    class Handler(BaseHTTPRequestHandler):
+        stats: Stats
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def reply(self, body: bytes, received: int = 0) -> None:
+            time.sleep(latency)
+            self.stats.add(received + len(body))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stats_reply(self) -> None:
+            body = json.dumps(self.stats.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    class RPCHandler(Handler):
+        stats = rpc_stats
+
+        def do_GET(self) -> None:
+            self.stats_reply()
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            chain = state["chains"][self.path.strip("/")]
+            request = json.loads(body)
+            if isinstance(request, list):
+                response: Any = [chain.handle(r) for r in request]
+            else:
+                response = chain.handle(request)
+            self.reply(json.dumps(response).encode(), len(body))
+
+    class LlamaHandler(Handler):
+        stats = llama_stats
+
+        def do_GET(self) -> None:
+            if self.path == "/_stats":
+                return self.stats_reply()
+            if self.path.startswith("/prices/current/"):
+                return self.reply(prices(self.path))
+            body = state["llama"].get(self.path.split("?")[0])
+            if body is None:
+                self.send_error(404)
+                return
+            self.reply(body)
+
+    return serve(RPCHandler), serve(LlamaHandler), state
+
+
+def stats(rpc: str, llama: str) -> dict[str, int]:
+    with urlopen(f"{rpc}/_stats") as r:
+        rpc_stats = json.loads(r.read())
+    with urlopen(f"{llama}/_stats") as r:
+        llama_stats = json.loads(r.read())
+    return {
+        "rpc_requests": rpc_stats["requests"],
+        "rpc_bytes": rpc_stats["bytes"],
+        "http_requests": llama_stats["requests"],
+        "http_bytes": llama_stats["bytes"],
+    }
+
+
+def worker(mode: str, rpc: str, llama: str) -> dict[str, dict[str, float]]:
+    """Run in a fresh process and data dir: every section on its own, or generate() end to end."""
+    sys.path.insert(0, str(SRC_DIR))
+    import generate
+
+    generate.OUTPUT_FILE = Path(os.environ["DATA_DIR"]) / "output.md"
+    generate.SECTIONS_FILE = Path(os.environ["DATA_DIR"]) / "sections.json"
+    runs: dict[str, Any] = {"generate": generate.generate}
+    if mode != "generate":
+        runs = {name: generate.fetcher(name) for name in generate.SECTION_MODULES}
+
+    report: dict[str, dict[str, float]] = {}
+    for name, run in runs.items():
+        before = stats(rpc, llama)
+        if mode == "memory":
+            tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        after = stats(rpc, llama)
+        report[name] = {key: float(after[key] - before[key]) for key in after}
+        if mode == "memory":
+            report[name] = {"peak_mb": tracemalloc.get_traced_memory()[1] / 1e6}
+            tracemalloc.stop()
+        else:
+            report[name]["seconds"] = elapsed
+    return report
+
+
+def run_worker(mode: str, rpc: str, llama: str) -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = {
+            **os.environ,
+            **{f"RPC_{chain.upper()}": f"{rpc}/{chain}" for chain in CHAINS},
+            "DATA_DIR": data_dir,
+            "LLAMA_API": llama,
+            "COINS_API": llama,
+            "KATANA_APR_API": f"{llama}/api/vaults",
+            "RPC_SNAPSHOT": "",
+            "HTTP_OFFLINE": "0",
+        }
+        result = subprocess.run(
+            [sys.executable, __file__, "--worker", mode, "--rpc", rpc, "--llama", llama],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    report: dict[str, dict[str, float]] = json.loads(result.stdout.splitlines()[-1])
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vaults", type=int, nargs="+", default=[10, 100, 1000, 10000], help="total vault counts")
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds added to every response")
+    parser.add_argument("--worker", choices=["sections", "memory", "generate"], help=argparse.SUPPRESS)
+    parser.add_argument("--rpc", help=argparse.SUPPRESS)
+    parser.add_argument("--llama", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # generate prints progress, the report goes on the last line
+        print(json.dumps(worker(args.worker, args.rpc, args.llama)))
+        return
+
+    rpc, llama, state = start_servers(args.latency / 1000)
+    print(
+        f"{'vaults':>6} {'section':<9} {'wall s':>8} {'rpc reqs':>8} {'rpc MB':>8} {'http reqs':>9} {'http MB':>8} {'peak MB':>8}"
+    )
+    for vaults in args.vaults:
+        # Vaults spread evenly over the chains
+        state["chains"] = {
+            c: FakeChain(c, vaults // len(CHAINS) + (i < vaults % len(CHAINS))) for i, c in enumerate(CHAINS)
+        }
+        state["llama"] = llama_routes()
+
+        sections = run_worker("sections", rpc, llama)
+        memory = run_worker("memory", rpc, llama)
+        sections.update(run_worker("generate", rpc, llama))
+        for name, row in sections.items():
+            peak = f"{memory[name]['peak_mb']:8.1f}" if name in memory else f"{'':>8}"
+            print(
+                f"{vaults:>6} {name:<9} {row['seconds']:8.2f} {row['rpc_requests']:8.0f} {row['rpc_bytes'] / 1e6:8.2f}"
+                f" {row['http_requests']:9.0f} {row['http_bytes'] / 1e6:8.2f} {peak}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compare peak memory and parse time of the /protocols Yield Aggregator sum: json.loads vs streaming.
+
+Usage:
+    python bench/protocols.py                    # synthetic payload shaped like api.llama.fi/protocols
+    python bench/protocols.py --file protocols.json
+"""
+
+import argparse
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, BinaryIO
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from utils import iter_json_array  # noqa: E402
+
+CATEGORIES = ["Dexs", "Lending", "Yield Aggregator", "Liquid Staking", "Bridge", "CDP", "Derivatives"]
+CHAINS = ["Ethereum", "Arbitrum", "Base", "Optimism", "Polygon", "BSC", "Solana", "Avalanche"]
+
+
+def synthetic_payload(n: int) -> bytes:
+    rng = random.Random(0)
+    protocols = []
+    for i in range(n):
+        chains = rng.sample(CHAINS, rng.randint(1, len(CHAINS)))
+        protocols.append(
+            {
+                "id": str(i),
+                "name": f"Protocol {i}",
+                "address": "0x" + "%040x" % rng.getrandbits(160),
+                "symbol": "TKN",
+                "url": f"https://protocol{i}.example",
+                "description": "A DeFi protocol. " * rng.randint(1, 20),
+                "chain": chains[0],
+                "logo": f"https://icons.llama.fi/protocol-{i}.jpg",
+                "category": rng.choice(CATEGORIES),
+                "chains": chains,
+                "slug": f"protocol-{i}",
+                "tvl": rng.random() * 1e9 if rng.random() > 0.1 else None,
+                "chainTvls": {c: rng.random() * 1e8 for c in chains},
+                "change_1h": rng.random(),
+                "change_1d": rng.random(),
+                "change_7d": rng.random(),
+            }
+        )
+    return json.dumps(protocols).encode()
+
+
+def sum_loads(f: BinaryIO) -> float:
+    data: list[dict[str, Any]] = json.loads(f.read().decode())
+    return float(sum(p.get("tvl") or 0 for p in data if p.get("category") == "Yield Aggregator"))
+
+
+def sum_streaming(f: BinaryIO) -> float:
+    return float(sum(p.get("tvl") or 0 for p in iter_json_array(f) if p.get("category") == "Yield Aggregator"))
+
+
+def measure(fn: Callable[[BinaryIO], float], payload: bytes) -> tuple[float, float, int]:
+    # Time without tracemalloc, which slows allocation-heavy code down
+    start = time.perf_counter()
+    total = fn(io.BytesIO(payload))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn(io.BytesIO(payload))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", type=Path, help="saved /protocols response")
+    parser.add_argument("--protocols", type=int, default=6000, help="synthetic protocol count")
+    args = parser.parse_args()
+
+    payload = args.file.read_bytes() if args.file else synthetic_payload(args.protocols)
+    print(f"Payload: {len(payload) / 1e6:.1f} MB")
+
+    for label, fn in (("json.loads", sum_loads), ("streaming", sum_streaming)):
+        total, elapsed, peak = measure(fn, payload)
+        print(f"{label:>10}: {elapsed * 1000:7.1f} ms, peak {peak / 1e6:6.1f} MB, total ${total:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
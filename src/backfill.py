@@ -0,0 +1,198 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any
+
+from web3 import Web3
+
+import store
+from calls import GET_WEEK, PRICE_PER_SHARE, WEEKLY_REWARD_AMOUNT, Result, decode_uint, word
+from rewards import DISTRIBUTORS
+from timeseries import update_series, value_at
+from utils import (
+    COINS_API,
+    ETH_PRICE_KEY,
+    LLAMA_API,
+    fetch_json,
+    get_web3,
+    get_week_and_year,
+    multicall,
+    week_start,
+)
+
+LLAMA_YEARN_PROTOCOL_API = f"{LLAMA_API}/protocol/yearn"
+COINS_CHART_API = f"{COINS_API}/chart"
+
+BACKFILL_WORKERS = 8
+
+
+def weeks_between(start: date, end: date) -> list[tuple[int, int]]:
+    """(week, year) of every newsletter week from start to end, inclusive."""
+    weeks = []
+    day = week_start(*get_week_and_year(start))
+    while day <= end:
+        weeks.append(get_week_and_year(day))
+        day += timedelta(weeks=1)
+    return weeks
+
+
+def week_timestamp(week: int, year: int) -> int:
+    return int(datetime.combine(week_start(week, year), time(), tzinfo=timezone.utc).timestamp())
+
+
+def block_timestamp(w3: Web3, chain: str, block: int) -> int:
+    timestamp = int(w3.eth.get_block(block)["timestamp"])
+    store.put_block_time(chain, block, timestamp)
+    return timestamp
+
+
+def block_at(w3: Web3, chain: str, timestamp: int) -> int:
+    """Last block at or before timestamp, by binary search narrowed by every block seen before."""
+    below, above = store.block_bounds(chain, timestamp)
+    if above is None:
+        head = w3.eth.block_number
+        head_time = block_timestamp(w3, chain, head)
+        if head_time <= timestamp:
+            return head
+        above = (head, head_time)
+    lo = below[0] if below else 0
+    hi = above[0]
+
+    # Invariant: block lo is at or before timestamp (or genesis), block hi is after it
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if block_timestamp(w3, chain, mid) <= timestamp:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def backfill_rewards(weeks: list[tuple[int, int]], names: list[str]) -> dict[str, list[dict[str, Any]]]:
+    """Weekly reward entries for each distributor in names, in the reward cache format."""
+    w3 = get_web3("mainnet")
+
+    # Per week, one multicall at the week's block: each distributor's getWeek plus each vault's pricePerShare
+    vaults = sorted({DISTRIBUTORS[name][1] for name in names})
+    calls = [(DISTRIBUTORS[name][0], GET_WEEK) for name in names]
+    calls += [(vault, PRICE_PER_SHARE) for vault in vaults]
+
+    def read_week(week_year: tuple[int, int]) -> list[Result]:
+        block = block_at(w3, "mainnet", week_timestamp(*week_year))
+        return multicall(w3, calls, block)
+
+    with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        states = list(pool.map(read_week, weeks))
+
+    # Rewards of the distributor week before each run's current one
+    rows = []  # (name, week, year, distributor_week, price_per_share)
+    for (week, year), results in zip(weeks, states):
+        pps_by_vault = {}
+        for vault, (success, data) in zip(vaults, results[len(names) :]):
+            if success:
+                pps_by_vault[vault] = decode_uint(data) / 1e18
+        for name, (success, data) in zip(names, results):
+            vault = DISTRIBUTORS[name][1]
+            if not success or vault not in pps_by_vault:
+                continue  # Not deployed yet at this block
+            distributor_week = decode_uint(data) - 1
+            if distributor_week >= 0:
+                rows.append((name, week, year, distributor_week, pps_by_vault[vault]))
+
+    # Past weekly reward amounts are final, so all of them are read in one multicall at the head
+    amount_calls = [
+        (DISTRIBUTORS[name][0], WEEKLY_REWARD_AMOUNT + word(distributor_week))
+        for name, _, _, distributor_week, _ in rows
+    ]
+    amounts = multicall(w3, amount_calls)
+
+    entries: dict[str, list[dict[str, Any]]] = {name: [] for name in names}
+    for (name, week, year, distributor_week, pps), (success, data) in zip(rows, amounts):
+        if not success:
+            continue
+        rewards_vault_tokens = decode_uint(data) / 1e18
+        entries[name].append(
+            {
+                "week": week,
+                "year": year,
+                "distributor_week": distributor_week,
+                "rewards_vault_tokens": rewards_vault_tokens,
+                "rewards_crvusd": rewards_vault_tokens * pps,
+                "price_per_share": pps,
+            }
+        )
+    return entries
+
+
+def closest(points: list[tuple[float, float]], timestamp: int) -> float | None:
+    """Value of the last (timestamp, value) point at or before timestamp."""
+    value = None
+    for ts, v in points:
+        if ts > timestamp:
+            break
+        value = v
+    return value
+
+
+def backfill_tvl(weeks: list[tuple[int, int]]) -> list[dict[str, Any]]:
+    """Weekly TVL entries from DefiLlama history (DefiLlama keeps no Yield Aggregator TVL history)."""
+    timestamps = [week_timestamp(week, year) for week, year in weeks]
+
+    yearn = fetch_json(LLAMA_YEARN_PROTOCOL_API)
+    yearn_tvl = sorted((float(p["date"]), float(p["totalLiquidityUSD"])) for p in yearn["tvl"])
+
+    start = min(timestamps) - 7 * 86400
+    chart = fetch_json(f"{COINS_CHART_API}/{ETH_PRICE_KEY}?start={start}&span={len(weeks) + 2}&period=1w")
+    eth_prices = sorted((float(p["timestamp"]), float(p["price"])) for p in chart["coins"][ETH_PRICE_KEY]["prices"])
+
+    update_series()
+
+    entries = []
+    for (week, year), ts in zip(weeks, timestamps):
+        tvl_usd = closest(yearn_tvl, ts)
+        eth_price = closest(eth_prices, ts)
+        defi_tvl = value_at(ts)
+        if tvl_usd is None or eth_price is None or defi_tvl is None:
+            continue
+        entries.append(
+            {
+                "week": week,
+                "year": year,
+                "tvl_usd": tvl_usd,
+                "tvl_eth": tvl_usd / eth_price,
+                "defi_tvl_usd": defi_tvl,
+            }
+        )
+    return entries
+
+
+def backfill(start: date, end: date, sections: list[str], overwrite: bool = False) -> None:
+    """Rebuild weekly cache entries between start and end for the given sections."""
+    weeks = weeks_between(start, end)
+    if not weeks:
+        return
+
+    entries: dict[str, list[dict[str, Any]]] = {}
+    reward_names = [name for name in sections if name in DISTRIBUTORS]
+    if reward_names:
+        entries.update(backfill_rewards(weeks, reward_names))
+    if "tvl" in sections:
+        entries["tvl"] = backfill_tvl(weeks)
+
+    for name, rows in entries.items():
+        existing = {(e["year"], e["week"]) for e in store.history(name)}
+        new_rows = [row for row in rows if overwrite or (row["year"], row["week"]) not in existing]
+        store.upsert_many(name, new_rows)
+        store.export(name)
+        print(f"Backfilled {len(new_rows)} {name} weeks ({len(rows) - len(new_rows)} already cached)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild weekly cache entries for past weeks.")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, default=date.today() - timedelta(weeks=1))
+    parser.add_argument("--sections", nargs="+", choices=["tvl", *DISTRIBUTORS], default=["tvl", *DISTRIBUTORS])
+    parser.add_argument("--overwrite", action="store_true", help="replace weeks that are already cached")
+    args = parser.parse_args()
+
+    backfill(args.start, args.end, args.sections, args.overwrite)
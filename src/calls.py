@@ -0,0 +1,88 @@
+from eth_utils.crypto import keccak
+
+# Multicall results are (success, returnData) with returnData a view into the aggregate3 response
+Result = tuple[bool, memoryview]
+
+
+def selector(signature: str) -> bytes:
+    return keccak(text=signature)[:4]
+
+
+# Selectors of every function the newsletter calls, computed once
+AGGREGATE3 = selector("aggregate3((address,bool,bytes)[])")
+GET_ALL_ENDORSED_VAULTS = selector("getAllEndorsedVaults()")
+VAULT_INFO = selector("vaultInfo(address)")
+NAME = selector("name()")
+ASSET = selector("asset()")
+DECIMALS = selector("decimals()")
+TOTAL_ASSETS = selector("totalAssets()")
+PRICE_PER_SHARE = selector("pricePerShare()")
+GET_STRATEGY_APR = selector("getStrategyApr(address,int256)")
+GET_WEEK = selector("getWeek()")
+WEEKLY_REWARD_AMOUNT = selector("weeklyRewardAmount(uint256)")
+LATEST_ROUND_DATA = selector("latestRoundData()")
+
+
+def word(value: int) -> bytes:
+    """One ABI word for a uint or int value."""
+    return value.to_bytes(32, "big", signed=value < 0)
+
+
+def address_word(address: str) -> bytes:
+    return bytes(12) + bytes.fromhex(address.removeprefix("0x"))
+
+
+def decode_uint(data: bytes | memoryview) -> int:
+    """First word of data as a uint (also fits uint8 and bool results)."""
+    if len(data) < 32:
+        raise ValueError(f"Expected an ABI word, got {len(data)} bytes")
+    return int.from_bytes(data[:32], "big")
+
+
+def decode_int(data: bytes | memoryview) -> int:
+    """First word of data as a two's complement int."""
+    if len(data) < 32:
+        raise ValueError(f"Expected an ABI word, got {len(data)} bytes")
+    return int.from_bytes(data[:32], "big", signed=True)
+
+
+def decode_address(data: bytes | memoryview) -> str:
+    """First word of data as a lowercase address."""
+    if len(data) < 32:
+        raise ValueError(f"Expected an ABI word, got {len(data)} bytes")
+    return "0x" + data[12:32].hex()
+
+
+def decode_string(data: bytes | memoryview, offset: int = 0) -> str:
+    """String whose head (the offset of its length word) is at offset in data."""
+    start = decode_uint(data[offset:])
+    length = decode_uint(data[start:])
+    if start + 32 + length > len(data):
+        raise ValueError("String runs past the end of the data")
+    return bytes(data[start + 32 : start + 32 + length]).decode()
+
+
+def encode_aggregate3(calls: list[tuple[str, bytes]]) -> bytes:
+    """aggregate3 calldata for (target, data) calls, all allowed to fail, built by byte concatenation."""
+    heads, tails = [], []
+    offset = 32 * len(calls)
+    for target, data in calls:
+        heads.append(word(offset))
+        padding = bytes(-len(data) % 32)
+        tails.append(address_word(target) + word(1) + word(96) + word(len(data)) + data + padding)
+        offset += len(tails[-1])
+    return AGGREGATE3 + word(32) + word(len(calls)) + b"".join(heads) + b"".join(tails)
+
+
+def decode_aggregate3(data: bytes) -> list[Result]:
+    """(success, returnData) of each call in an aggregate3 response, as views into data without copying."""
+    view = memoryview(data)
+    array = decode_uint(view) + 32  # First element offset, offsets are relative to it
+    results = []
+    for i in range(decode_uint(view[array - 32 :])):
+        start = array + decode_uint(view[array + 32 * i :])
+        success = decode_uint(view[start:]) != 0
+        data_start = start + decode_uint(view[start + 32 :])
+        length = decode_uint(view[data_start:])
+        results.append((success, view[data_start + 32 : data_start + 32 + length]))
+    return results
@@ -0,0 +1,178 @@
+import importlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Protocol
+
+import content
+from utils import REFRESH_INTERVALS, REFRESH_RETRY
+
+ROUTES_HELP = """\
+GET  /                      newsletter rendered from the latest sections and content.py
+GET  /sections.json         section snapshot
+GET  /sections/<name>.json  one section's data and fetch time
+GET  /status                last refresh, error and next refresh of each section
+POST /refresh[/<name>]      refresh all sections, or one, now
+"""
+
+
+class Generator(Protocol):
+    """The generate module, as passed in by its CLI: the daemon must share that module (run as __main__) and its
+    snapshot lock rather than import a second copy of it."""
+
+    SECTION_MODULES: dict[str, str]
+
+    def generate(self, names: list[str] | None = None, stale_fallback: bool = True) -> None: ...
+
+    def load_snapshot(self, path: Path = ...) -> dict[str, Any] | None: ...
+
+    def render(self, week: int, year: int, data: dict[str, dict[str, Any]]) -> str: ...
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class Scheduler:
+    """Refreshes each section into the snapshot on its own interval, one thread per section.
+
+    Sections keep running in this process, so web3, RPC pools, HTTP sessions and price caches stay warm between
+    refreshes. A failed refresh is retried after REFRESH_RETRY seconds; the last good data stays in the snapshot
+    rather than being replaced by stale data.
+    """
+
+    def __init__(self, generate: Generator, intervals: dict[str, float]) -> None:
+        self.generate = generate
+        self.intervals = intervals
+        self.lock = threading.Lock()
+        self.status: dict[str, dict[str, Any]] = {
+            name: {"interval": interval, "refreshed_at": None, "seconds": None, "error": None, "next_refresh": None}
+            for name, interval in intervals.items()
+        }
+        self.wake = {name: threading.Event() for name in intervals}
+
+    def start(self) -> None:
+        for name in self.intervals:
+            threading.Thread(target=self.run, args=(name,), name=f"refresh-{name}", daemon=True).start()
+
+    def run(self, name: str) -> None:
+        while True:
+            start = time.monotonic()
+            try:
+                self.generate.generate([name], stale_fallback=False)
+                error, delay = None, self.intervals[name]
+            except Exception as e:
+                error, delay = f"{type(e).__name__}: {e}", min(self.intervals[name], REFRESH_RETRY)
+                print(f"Refreshing {name} failed, retrying in {delay:g}s: {error}")
+            with self.lock:
+                status = self.status[name]
+                status["error"] = error
+                if error is None:
+                    status["refreshed_at"], status["seconds"] = now_iso(), round(time.monotonic() - start, 3)
+                status["next_refresh"] = datetime.fromtimestamp(time.time() + delay, timezone.utc).isoformat(
+                    timespec="seconds"
+                )
+            self.wake[name].wait(delay)
+            self.wake[name].clear()
+
+    def refresh(self, name: str) -> None:
+        self.wake[name].set()
+
+
+class Renderer:
+    """Renders the newsletter from the snapshot, reloading content.py whenever it changed."""
+
+    def __init__(self, generate: Generator) -> None:
+        self.generate = generate
+        self.lock = threading.Lock()
+        self.content_mtime = Path(content.__file__).stat().st_mtime_ns
+
+    def render(self) -> str:
+        snapshot = self.generate.load_snapshot()
+        if snapshot is None:
+            raise LookupError("No sections fetched yet")
+        missing = [name for name in self.generate.SECTION_MODULES if name not in snapshot["sections"]]
+        if missing:
+            raise LookupError(f"Waiting for the first {', '.join(missing)} refresh")
+        with self.lock:
+            mtime = Path(content.__file__).stat().st_mtime_ns
+            if mtime != self.content_mtime:
+                importlib.reload(content)
+                self.content_mtime = mtime
+            return self.generate.render(snapshot["week"], snapshot["year"], snapshot["sections"])
+
+
+def make_handler(scheduler: Scheduler, renderer: Renderer) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def reply(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def reply_json(self, status: int, data: Any) -> None:
+            self.reply(status, json.dumps(data, indent=2).encode(), "application/json")
+
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if path in ("/", "/newsletter.md"):
+                try:
+                    self.reply(200, renderer.render().encode(), "text/markdown; charset=utf-8")
+                except LookupError as e:
+                    self.reply(503, f"{e}\n".encode(), "text/plain; charset=utf-8")
+                except Exception as e:
+                    # content.py may be mid-edit
+                    self.reply(500, f"Render failed: {e}\n".encode(), "text/plain; charset=utf-8")
+            elif path == "/sections.json":
+                snapshot = scheduler.generate.load_snapshot()
+                if snapshot is None:
+                    self.reply_json(503, {"error": "No sections fetched yet"})
+                else:
+                    self.reply_json(200, snapshot)
+            elif match := re.fullmatch(r"/sections/(\w+)\.json", path):
+                snapshot = scheduler.generate.load_snapshot() or {"sections": {}, "fetched_at": {}}
+                name = match.group(1)
+                if name in snapshot["sections"]:
+                    self.reply_json(
+                        200, {"fetched_at": snapshot["fetched_at"][name], "data": snapshot["sections"][name]}
+                    )
+                else:
+                    self.reply_json(404, {"error": f"No {name} section"})
+            elif path == "/status":
+                with scheduler.lock:
+                    self.reply_json(200, scheduler.status)
+            else:
+                self.reply(404, ROUTES_HELP.encode(), "text/plain; charset=utf-8")
+
+        def do_POST(self) -> None:
+            match = re.fullmatch(r"/refresh(?:/(\w+))?", self.path.split("?")[0])
+            if not match or (match.group(1) and match.group(1) not in scheduler.intervals):
+                self.reply(404, ROUTES_HELP.encode(), "text/plain; charset=utf-8")
+                return
+            names = [match.group(1)] if match.group(1) else list(scheduler.intervals)
+            for name in names:
+                scheduler.refresh(name)
+            self.reply_json(202, {"refreshing": names})
+
+    return Handler
+
+
+def serve(generate: Generator, host: str, port: int, intervals: dict[str, float] = REFRESH_INTERVALS) -> None:
+    """Keep every section fresh and serve the newsletter and section data over HTTP, until interrupted."""
+    scheduler = Scheduler(generate, intervals)
+    server = ThreadingHTTPServer((host, port), make_handler(scheduler, Renderer(generate)))
+    server.daemon_threads = True
+    scheduler.start()
+    print(f"Serving the newsletter on http://{host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
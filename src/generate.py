@@ -1,14 +1,47 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from concurrent.futures import Future
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
 import content
-import tvl
-import vaults
-import ycrv
-import yyb
-from utils import fmt_usd, get_week_and_year
+import http_cache
+import store
+import tracing
+import utils
+from utils import FETCH_DEADLINE, SECTION_DEADLINES, fmt_usd, get_week_and_year
 
 OUTPUT_FILE = Path(__file__).parent.parent / "output.md"
+PROFILE_FILE = OUTPUT_FILE.with_name("profile.json")
+SECTIONS_FILE = OUTPUT_FILE.with_name("sections.json")
+
+# Bumped whenever the shape of section data changes, so render never reads a snapshot it can't handle
+SNAPSHOT_VERSION = 1
+WATCH_INTERVAL = 0.5  # seconds between content.py checks in render --watch
+_sections_lock = threading.Lock()  # serve refreshes sections concurrently, each merging into the snapshot
+
+# Section name -> module with its get_data(). Modules are imported on first fetch, so running one section
+# (or only rendering) doesn't pay for web3 and numpy.
+# Sections are independent (DefiLlama HTTP vs. mainnet/L2 RPC), so they are fetched concurrently.
+SECTION_MODULES = {
+    "tvl": "tvl",
+    "vaults": "vaults",
+    "rewards": "rewards",
+}
+
+
+def fetcher(name: str) -> Callable[[], dict[str, Any]]:
+    fetch: Callable[[], dict[str, Any]] = importlib.import_module(SECTION_MODULES[name]).get_data
+    return fetch
 
 
 def render_overview(week: int, year: int) -> str:
@@ -92,6 +125,8 @@ def render_vaults(data: dict[str, Any]) -> str:
 
 
 def render_ycrv(data: dict[str, Any]) -> str:
+    if data["wow_pct"] is None or data["prev_rewards_crvusd"] is None:
+        return f"## yCRV\nThis week yCRV stakers received **{data['rewards_crvusd']:,.2f} crvUSD** rewards."
     wow = f"+{data['wow_pct']:.1f}" if data["wow_pct"] > 0 else f"{data['wow_pct']:.1f}"
     text = content.YCRV.format(
         rewards=f"{data['rewards_crvusd']:,.2f}",
@@ -113,6 +148,15 @@ def render_yyb(data: dict[str, Any]) -> str:
     return "## yYB" + text
 
 
+def mark_stale(text: str, data: dict[str, Any]) -> str:
+    """Section text, closed by a note if it was rendered from earlier data."""
+    stale = data.get("stale")
+    if not stale:
+        return text
+    note = f"> **Stale data** from week {stale['week']}, {stale['year']}: this week's fetch {stale['reason']}."
+    return f"{text.rstrip()}\n\n{note}"
+
+
 def render_alpha() -> str:
     return "## Alpha Corner" + content.ALPHA
 
@@ -125,29 +169,237 @@ def render_sign_off() -> str:
     return content.SIGN_OFF.strip()
 
 
-def generate() -> None:
-    week, year = get_week_and_year()
+def timed(name: str, fetch: Callable[[], dict[str, Any]]) -> tuple[dict[str, Any], float]:
+    start = time.monotonic()
+    with tracing.section(name), tracing.span("section", name):
+        data = fetch()
+    return data, time.monotonic() - start
+
+
+# Sections that missed their deadline in this process and may still be running
+abandoned: set[str] = set()
+
+
+def section_store_name(name: str) -> str:
+    return f"{name}_section"
+
 
-    tvl_data = tvl.get_data()
-    vaults_data = vaults.get_data()
-    ycrv_data = ycrv.get_data()
-    yyb_data = yyb.get_data()
+def stale_section(name: str, reason: str) -> dict[str, Any]:
+    """Latest earlier data of section name, marked stale with the reason this week's fetch didn't make it.
 
+    That is the section rebuilt from its weekly history (the tracked data/history.db entries), via its module's
+    get_cached_data, unless the section copy stored by each successful fetch is from a later week.
+    """
+    entry = store.latest(section_store_name(name))
+    cached = getattr(importlib.import_module(SECTION_MODULES[name]), "get_cached_data", None)
+    rebuilt = cached() if cached is not None else None
+    if rebuilt is not None:
+        week, year, data = rebuilt
+        if entry is None or (entry["year"], entry["week"]) <= (year, week):
+            entry = {"week": week, "year": year, "fetched_at": None, "data": data}
+    if entry is None:
+        raise RuntimeError(f"{name} section {reason}, and there is no earlier data to fall back on")
+    print(f"Using stale {name} data from week {entry['week']}, {entry['year']}: {reason}")
+    stale = {"week": entry["week"], "year": entry["year"], "fetched_at": entry["fetched_at"], "reason": reason}
+    return dict(entry["data"], stale=stale)
+
+
+def start_fetch(name: str) -> "Future[tuple[dict[str, Any], float]]":
+    """Fetch section name on a daemon thread, so a section past its deadline can't hold up the process exit."""
+    future: Future[tuple[dict[str, Any], float]] = Future()
+    fetch = fetcher(name)
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(timed(name, fetch))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"fetch-{name}", daemon=True).start()
+    return future
+
+
+def fetch_sections(names: list[str], stale_fallback: bool = True) -> dict[str, dict[str, Any]]:
+    """Run the named section fetchers at once, each under its SECTION_DEADLINES share of FETCH_DEADLINE, and
+    report each section's timing. Fetched sections are stored; with stale_fallback, a section that misses its
+    deadline or fails is replaced by its stored data, so the run finishes within FETCH_DEADLINE.
+
+    Sections that missed their deadline keep running and are added to abandoned.
+    """
+    start = time.monotonic()
+    week, year = get_week_and_year()
+    futures = {name: start_fetch(name) for name in names}
+
+    results = {}
+    for name, future in futures.items():
+        budget = min(SECTION_DEADLINES.get(name, FETCH_DEADLINE), FETCH_DEADLINE)
+        try:
+            results[name], elapsed = future.result(timeout=max(0.0, start + budget - time.monotonic()))
+        except Exception as e:
+            # A TimeoutError from a finished future was raised by the section itself
+            missed = isinstance(e, TimeoutError) and not future.done()
+            if missed:
+                abandoned.add(name)
+            if not stale_fallback:
+                if missed:
+                    raise TimeoutError(f"{name} section missed its {budget:g}s deadline") from None
+                raise
+            if missed:
+                results[name] = stale_section(name, f"missed its {budget:g}s deadline")
+            else:
+                print(f"Fetching {name} failed: {e}")
+                results[name] = stale_section(name, f"failed ({type(e).__name__})")
+            continue
+        print(f"Fetched {name} in {elapsed:.2f}s")
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        store.upsert(section_store_name(name), {"week": week, "year": year, "fetched_at": now, "data": results[name]})
+
+    print(f"Fetched all sections in {time.monotonic() - start:.2f}s")
+    return results
+
+
+def load_snapshot(path: Path = SECTIONS_FILE) -> dict[str, Any] | None:
+    """Saved section snapshot, or None if there is none or it was written with another SNAPSHOT_VERSION."""
+    if not path.exists():
+        return None
+    snapshot: dict[str, Any] = json.loads(path.read_text())
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def save_sections(week: int, year: int, data: dict[str, dict[str, Any]]) -> None:
+    """Merge freshly fetched sections into the week's snapshot, starting a new one for a new week."""
+    with _sections_lock:
+        snapshot = load_snapshot()
+        if snapshot is None or (snapshot["week"], snapshot["year"]) != (week, year):
+            snapshot = {"version": SNAPSHOT_VERSION, "week": week, "year": year, "fetched_at": {}, "sections": {}}
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        snapshot["sections"].update(data)
+        snapshot["fetched_at"].update({name: data[name].get("stale", {}).get("fetched_at", now) for name in data})
+
+        # Written atomically, render --watch and serve may be reading it
+        with tempfile.NamedTemporaryFile("w", dir=SECTIONS_FILE.parent, delete=False) as tmp:
+            tmp.write(json.dumps(snapshot, indent=2))
+        os.replace(tmp.name, SECTIONS_FILE)
+
+
+def render(week: int, year: int, data: dict[str, dict[str, Any]]) -> str:
     sections = [
         render_overview(week, year),
-        render_glance(tvl_data),
-        render_vaults(vaults_data),
-        render_ycrv(ycrv_data),
-        render_yyb(yyb_data),
+        mark_stale(render_glance(data["tvl"]), data["tvl"]),
+        mark_stale(render_vaults(data["vaults"]), data["vaults"]),
+        mark_stale(render_ycrv(data["rewards"]["ycrv"]), data["rewards"]),
+        mark_stale(render_yyb(data["rewards"]["yyb"]), data["rewards"]),
         render_alpha(),
         render_disclaimer(),
         render_sign_off(),
     ]
+    return "\n\n".join(sections)
+
+
+def render_snapshot(path: Path = SECTIONS_FILE) -> None:
+    """Write the newsletter from a section snapshot. Makes no network calls and leaves every cache untouched."""
+    start = time.perf_counter()
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        raise SystemExit(f"No snapshot (version {SNAPSHOT_VERSION}) at {path}, fetch the sections first")
+    missing = [name for name in SECTION_MODULES if name not in snapshot["sections"]]
+    if missing:
+        raise SystemExit(f"Snapshot has no {', '.join(missing)} data, fetch it first: generate.py {' '.join(missing)}")
+    OUTPUT_FILE.write_text(render(snapshot["week"], snapshot["year"], snapshot["sections"]))
+    print(f"Newsletter rendered from {path.name} in {(time.perf_counter() - start) * 1000:.0f}ms: {OUTPUT_FILE}")
+
+
+def watch(path: Path = SECTIONS_FILE) -> None:
+    """Re-render whenever content.py or the snapshot changes, until interrupted."""
+    watched = [Path(content.__file__), path]
+    seen = None
+    while True:
+        mtimes = [p.stat().st_mtime_ns if p.exists() else 0 for p in watched]
+        if mtimes != seen:
+            seen = mtimes
+            try:
+                importlib.reload(content)
+                render_snapshot(path)
+            except (Exception, SystemExit) as e:
+                # Keep watching through half-saved edits
+                print(f"Render failed: {e}")
+        time.sleep(WATCH_INTERVAL)
+
+
+def generate(names: list[str] | None = None, stale_fallback: bool = True) -> None:
+    """Fetch the named sections (all by default) and save them; with all sections, also write the newsletter.
+    With stale_fallback, sections that can't be fetched in time are taken from stored data instead of failing.
+    """
+    week, year = get_week_and_year()
 
-    output = "\n\n".join(sections)
-    OUTPUT_FILE.write_text(output)
-    print(f"Newsletter generated: {OUTPUT_FILE}")
+    data = fetch_sections(names or list(SECTION_MODULES), stale_fallback)
+    save_sections(week, year, data)
+
+    if names is None:
+        OUTPUT_FILE.write_text(render(week, year, data))
+        print(f"Newsletter generated: {OUTPUT_FILE}")
 
 
 if __name__ == "__main__":
-    generate()
+    # Options are accepted before or after the subcommand
+    options = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    options.add_argument("--offline", action="store_true", help="serve HTTP data from the local cache only")
+    options.add_argument("--snapshot", metavar="NAME", help="pin on-chain reads to the blocks of snapshot NAME")
+    options.add_argument("--profile", action="store_true", help=f"write per-call timings to {PROFILE_FILE.name}")
+
+    parser = argparse.ArgumentParser(description="Generate the weekly newsletter.", parents=[options])
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    for name in SECTION_MODULES:
+        commands.add_parser(name, parents=[options], help=f"fetch only the {name} section into {SECTIONS_FILE.name}")
+    render_parser = commands.add_parser(
+        "render", parents=[options], help=f"write {OUTPUT_FILE.name} from the {SECTIONS_FILE.name} snapshot"
+    )
+    render_parser.add_argument("--watch", action="store_true", help="re-render whenever content.py changes")
+    render_parser.add_argument("--from", dest="source", type=Path, default=SECTIONS_FILE, help="snapshot to render")
+    serve_parser = commands.add_parser(
+        "serve", parents=[options], help="refresh sections on a schedule and serve the newsletter over HTTP"
+    )
+    serve_parser.add_argument("--host", default=utils.DAEMON_HOST, help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=utils.DAEMON_PORT, help="port to listen on")
+    args = parser.parse_args()
+
+    http_cache.OFFLINE = http_cache.OFFLINE or getattr(args, "offline", False)
+    if getattr(args, "snapshot", None):
+        utils.RPC_SNAPSHOT = args.snapshot
+    profile = tracing.Profile()
+    if getattr(args, "profile", False):
+        tracing.SINKS.append(profile)
+    try:
+        if args.command == "render" and args.watch:
+            try:
+                watch(args.source)
+            except KeyboardInterrupt:
+                pass
+        elif args.command == "render":
+            render_snapshot(args.source)
+        elif args.command == "serve":
+            import daemon
+
+            try:
+                # This module runs as __main__: hand it over rather than have the daemon import a second copy
+                daemon.serve(sys.modules[__name__], args.host, args.port)
+            except KeyboardInterrupt:
+                pass
+        else:
+            generate([args.command] if args.command else None)
+    finally:
+        if getattr(args, "profile", False):
+            PROFILE_FILE.write_text(json.dumps(profile.report(), indent=2))
+            print(f"Profile written: {PROFILE_FILE}")
+        if abandoned:
+            # The output is written, but abandoned sections still hold worker threads (thread pools inside the
+            # sections) that a normal exit would join, so leave without waiting on them
+            if sys.exc_info()[0] is not None:
+                traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0 if sys.exc_info()[0] is None else 1)
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+from urllib.parse import urlsplit
+
+import tracing
+from store import DATA_DIR
+
+# requests is only loaded once something is actually downloaded
+if TYPE_CHECKING:
+    import requests
+
+CACHE_DIR = DATA_DIR / "http"
+BODIES_DIR = CACHE_DIR / "bodies"
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Serve only from cache, never touch the network (set by --offline)
+OFFLINE = os.getenv("HTTP_OFFLINE", "") not in ("", "0")
+
+# Seconds a cached response is served without revalidation, by URL prefix. Filled in by the modules that own each
+# API, under their configured base URL.
+TTLS: dict[str, float] = {}
+DEFAULT_TTL = 300
+
+CHUNK_SIZE = 64 * 1024
+
+
+_local = threading.local()  # requests.Session isn't thread-safe, and sections download from several threads
+
+
+def get_session() -> "requests.Session":
+    """This thread's session, kept across downloads so connections to each host stay open."""
+    session: "requests.Session | None" = getattr(_local, "session", None)
+    if session is None:
+        import requests
+
+        session = _local.session = requests.Session()
+    return session
+
+
+def ttl_for(url: str) -> float:
+    """TTL of the longest prefix in TTLS that url starts with."""
+    matches = [prefix for prefix in TTLS if url.startswith(prefix)]
+    return TTLS[max(matches, key=len)] if matches else DEFAULT_TTL
+
+
+def meta_path(url: str) -> Path:
+    return CACHE_DIR / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+
+def load_meta(url: str) -> dict[str, str | float] | None:
+    """Cache entry for url, or None if it was never fetched or its body was evicted."""
+    path = meta_path(url)
+    if not path.exists():
+        return None
+    meta: dict[str, str | float] = json.loads(path.read_text())
+    if not (BODIES_DIR / str(meta["body"])).exists():
+        return None
+    return meta
+
+
+def save_meta(url: str, meta: dict[str, str | float]) -> None:
+    with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, delete=False) as tmp:
+        tmp.write(json.dumps(meta))
+    os.replace(tmp.name, meta_path(url))
+
+
+def download(url: str, meta: dict[str, str | float] | None) -> dict[str, str | float]:
+    """Fetch url, revalidating against meta if given, and store the body by its sha256."""
+    headers = {}
+    if meta and meta.get("etag"):
+        headers["If-None-Match"] = str(meta["etag"])
+    if meta and meta.get("last_modified"):
+        headers["If-Modified-Since"] = str(meta["last_modified"])
+
+    session = get_session()
+    with (
+        tracing.span("http", urlsplit(url).netloc) as call,
+        session.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as r,
+    ):
+        if r.status_code == 304 and meta:
+            new_meta = dict(meta)  # Not modified, keep the cached body
+        else:
+            r.raise_for_status()
+            BODIES_DIR.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=BODIES_DIR, delete=False) as tmp:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    call.received += len(chunk)
+            os.replace(tmp.name, BODIES_DIR / digest.hexdigest())
+            new_meta = {
+                "url": url,
+                "body": digest.hexdigest(),
+                "etag": r.headers.get("ETag") or "",
+                "last_modified": r.headers.get("Last-Modified") or "",
+            }
+
+    new_meta["fetched_at"] = time.time()
+    save_meta(url, new_meta)
+    evict()
+    return new_meta
+
+
+def evict() -> None:
+    """Drop least recently used bodies until the cache fits in HTTP_CACHE_MAX_BYTES."""
+    bodies = []
+    for path in BODIES_DIR.iterdir():
+        try:
+            if not path.name.startswith("tmp"):
+                bodies.append((path.stat(), path))
+        except FileNotFoundError:
+            continue  # Evicted by a concurrent run
+    total = sum(stat.st_size for stat, _ in bodies)
+    for stat, path in sorted(bodies, key=lambda b: b[0].st_mtime):
+        if total <= HTTP_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= stat.st_size
+
+
+def http_open(url: str) -> BinaryIO:
+    """Open the response body for url, served from the on-disk cache when fresh."""
+    meta = load_meta(url)
+    if OFFLINE and meta is None:
+        raise FileNotFoundError(f"{url} is not cached (offline mode)")
+    if meta is None or (not OFFLINE and time.time() - float(meta["fetched_at"]) > ttl_for(url)):
+        meta = download(url, meta)
+        body = BODIES_DIR / str(meta["body"])
+    else:
+        with tracing.span("http_cache", urlsplit(url).netloc) as call:
+            body = BODIES_DIR / str(meta["body"])
+            call.received = body.stat().st_size
+
+    try:
+        os.utime(body)  # Mark as recently used
+        return body.open("rb")
+    except FileNotFoundError:
+        # A concurrent run evicted the body since it was looked up
+        if OFFLINE:
+            raise
+        meta = download(url, None)
+        return (BODIES_DIR / str(meta["body"])).open("rb")
+
+
+def http_get(url: str) -> bytes:
+    with http_open(url) as f:
+        return f.read()
@@ -0,0 +1,119 @@
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from web3 import Web3
+from web3.types import BlockIdentifier
+
+import store
+import tracing
+from calls import GET_ALL_ENDORSED_VAULTS
+from rpc import CachingProvider
+from utils import (
+    LOG_BATCH_SIZE,
+    LOG_CONFIRMATIONS,
+    LOG_RANGE_BLOCKS,
+    LOG_WORKERS,
+    REGISTRY_ADDRESSES,
+    load_abi,
+    multicall,
+)
+
+
+def enumerate_registries(w3: Web3, registries: Sequence[str], block: BlockIdentifier) -> dict[str, list[str]]:
+    """Every vault endorsed in each registry at block, read with one multicall. Registries whose call fails are
+    left out, so one broken registry doesn't hide the others."""
+    if not registries:
+        return {}
+    results = multicall(w3, [(registry, GET_ALL_ENDORSED_VAULTS) for registry in registries], block)
+
+    endorsed: dict[str, list[str]] = {}
+    for registry, (success, data) in zip(registries, results):
+        if not success:
+            print(f"getAllEndorsedVaults failed for registry {registry}, skipping it")
+            continue
+        endorsed[registry] = [
+            w3.to_checksum_address(addr)
+            for sublist in w3.codec.decode(["address[][]"], bytes(data))[0]
+            for addr in sublist
+        ]
+    return endorsed
+
+
+def event_topics(w3: Web3) -> tuple[str, str]:
+    """Topics of the NewEndorsedVault and RemovedVault events."""
+    registry_contract = w3.eth.contract(abi=load_abi("registry"))
+    return registry_contract.events.NewEndorsedVault.topic, registry_contract.events.RemovedVault.topic
+
+
+def fetch_logs(w3: Web3, registries: Sequence[str], from_block: int, to_block: int) -> list[Any]:
+    """Endorsement and removal logs of registries, fetched in LOG_RANGE_BLOCKS ranges.
+
+    Ranges are sent LOG_BATCH_SIZE at a time as JSON-RPC batches, with batches running in parallel.
+    """
+    topics = list(event_topics(w3))
+    addresses = [w3.to_checksum_address(r) for r in registries]
+    ranges = [
+        (start, min(start + LOG_RANGE_BLOCKS - 1, to_block))
+        for start in range(from_block, to_block + 1, LOG_RANGE_BLOCKS)
+    ]
+    batches = [ranges[i : i + LOG_BATCH_SIZE] for i in range(0, len(ranges), LOG_BATCH_SIZE)]
+
+    def fetch_batch(batch: list[tuple[int, int]]) -> list[Any]:
+        with w3.batch_requests() as requests:
+            for start, end in batch:
+                requests.add(
+                    w3.eth.get_logs({"address": addresses, "topics": [topics], "fromBlock": start, "toBlock": end})
+                )
+            return [log for logs in requests.execute() for log in logs]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(LOG_WORKERS, len(batches)))) as pool:
+        logs = [log for batch_logs in pool.map(tracing.bind(fetch_batch), batches) for log in batch_logs]
+    return sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"]))
+
+
+def discover_vaults(w3: Web3, chain: str) -> list[tuple[str, str]]:
+    """(vault, registry) of every endorsed vault on chain.
+
+    The local registry index is kept up to date from registry events, up to LOG_CONFIRMATIONS blocks behind the head
+    so a reorg can't undo an event it already applied. A registry seen for the first time, or whose logs can't be
+    read, is enumerated in full at that block instead. Runs pinned to a snapshot block read the endorsed set at that
+    block directly, which also leaves out vaults endorsed or removed after it.
+    """
+    registries: list[str] = [w3.to_checksum_address(r) for r in REGISTRY_ADDRESSES]
+    if isinstance(w3.provider, CachingProvider) and w3.provider.block is not None:
+        enumerated = enumerate_registries(w3, registries, w3.provider.block)
+        return [(vault, registry) for registry, vaults in enumerated.items() for vault in vaults]
+
+    safe = int(w3.eth.block_number) - LOG_CONFIRMATIONS
+    cursors = store.registry_cursors(chain)
+    new = [r for r in registries if r not in cursors]
+    known = [r for r in registries if r in cursors and cursors[r] < safe]
+
+    changes: list[tuple[bool, str, str, int]] = []
+    replaced: list[str] = []
+    advanced: dict[str, int] = {}
+    if known:
+        try:
+            new_endorsed = bytes.fromhex(event_topics(w3)[0].removeprefix("0x"))
+            for log in fetch_logs(w3, known, min(cursors[r] for r in known) + 1, safe):
+                registry: str = w3.to_checksum_address(log["address"])
+                if log["blockNumber"] <= cursors[registry]:
+                    continue
+                vault = w3.to_checksum_address("0x" + bytes(log["topics"][1])[-20:].hex())
+                changes.append((bytes(log["topics"][0]) == new_endorsed, vault, registry, log["blockNumber"]))
+            advanced.update(dict.fromkeys(known, safe))
+        except Exception as e:
+            # Providers without eth_getLogs (or with tighter range caps): enumerate these registries too
+            print(f"Registry events unavailable on {chain} ({e}), enumerating registries")
+            new, replaced = new + known, known
+
+    enumerated = enumerate_registries(w3, new, safe)
+    for registry, vaults in enumerated.items():
+        changes.extend((True, vault, registry, safe) for vault in vaults)
+        advanced[registry] = safe
+    replaced = [r for r in replaced if r in enumerated]
+
+    if advanced:
+        store.update_registry_index(chain, changes, advanced, replaced)
+    return store.endorsed_vaults(chain)
@@ -0,0 +1,133 @@
+from typing import Any
+
+from calls import GET_WEEK, PRICE_PER_SHARE, WEEKLY_REWARD_AMOUNT, Result, decode_uint, word
+from utils import block_time, get_web3, get_week_and_year, load_cache, load_cache_history, multicall, save_cache
+
+YVCRVUSD2_ADDRESS = "0xBF319dDC2Edc1Eb6FDf9910E39b37Be221C8805F"
+
+WEEK_SECONDS = 7 * 24 * 3600
+
+# Staking products paid through a RewardDistributor: cache name -> (distributor, vault rewards are paid in, start of
+# the distributor's week 0). Weeks roll over Thursday 00:00 UTC.
+DISTRIBUTORS = {
+    "ycrv": ("0xB226c52EB411326CdB54824a88aBaFDAAfF16D3d", YVCRVUSD2_ADDRESS, 1717632000),  # 2024-06-06
+    "yyb": ("0x1d02F6A86Ed5650f93E40FCD62fa5727c32ad746", YVCRVUSD2_ADDRESS, 1766016000),  # 2025-12-18
+}
+
+
+def predict_week(name: str, timestamp: int) -> int:
+    """Distributor's week at timestamp. Only a guess to save a round trip: getWeek is read alongside and wins."""
+    return (timestamp - DISTRIBUTORS[name][2]) // WEEK_SECONDS
+
+
+def get_data() -> dict[str, dict[str, Any]]:
+    """Fetch previous week's rewards from every RewardDistributor, keyed by cache name.
+
+    getWeek, both weeklyRewardAmount reads (for the predicted week) and one pricePerShare per vault
+    go out in a single multicall. Only distributors whose week was mispredicted need a second one. The prediction
+    depends only on the timestamp of the block read at, so a snapshot makes the same calls on every run.
+    """
+    week, year = get_week_and_year()
+    w3 = get_web3("mainnet")
+    timestamp = block_time(w3)
+
+    def amount_calls(distributor: str, current_week: int) -> list[tuple[str, bytes]]:
+        return [
+            (distributor, WEEKLY_REWARD_AMOUNT + word(current_week - 1)),
+            (distributor, WEEKLY_REWARD_AMOUNT + word(current_week - 2)),
+        ]
+
+    vaults = sorted({vault for _, vault, _ in DISTRIBUTORS.values()})
+    predicted = {name: predict_week(name, timestamp) for name in DISTRIBUTORS}
+
+    calls = [(vault, PRICE_PER_SHARE) for vault in vaults]
+    slots = {}  # name -> index of its getWeek result, followed by its predicted amounts
+    for name, (distributor, _, _) in DISTRIBUTORS.items():
+        slots[name] = len(calls)
+        calls.append((distributor, GET_WEEK))
+        calls.extend(amount_calls(distributor, predicted[name]))
+
+    results = multicall(w3, calls)
+
+    def decode(result: Result) -> int:
+        success, data = result
+        if not success:
+            raise ValueError("RewardDistributor read reverted")
+        return decode_uint(data)
+
+    # Rewards are in vault tokens (18 decimals), converted to crvUSD with pricePerShare
+    pps = {vault: decode(result) / 1e18 for vault, result in zip(vaults, results)}
+    current_weeks = {name: decode(results[slots[name]]) for name in DISTRIBUTORS}
+
+    amounts = {}
+    retry = []
+    for name in DISTRIBUTORS:
+        if predicted[name] == current_weeks[name]:
+            amounts[name] = (decode(results[slots[name] + 1]), decode(results[slots[name] + 2]))
+        else:
+            retry.append(name)
+
+    if retry:
+        retry_calls = [call for name in retry for call in amount_calls(DISTRIBUTORS[name][0], current_weeks[name])]
+        retry_results = multicall(w3, retry_calls)
+        for i, name in enumerate(retry):
+            amounts[name] = (decode(retry_results[2 * i]), decode(retry_results[2 * i + 1]))
+
+    data = {}
+    for name, (_, vault, _) in DISTRIBUTORS.items():
+        reward_amount, prev_reward_amount = amounts[name]
+        rewards_vault_tokens = reward_amount / 1e18
+        rewards_crvusd = rewards_vault_tokens * pps[vault]
+        prev_rewards_crvusd = prev_reward_amount / 1e18 * pps[vault]
+
+        prev_week = current_weeks[name] - 1
+        save_cache(
+            name,
+            {
+                "week": week,
+                "year": year,
+                "distributor_week": prev_week,
+                "rewards_vault_tokens": rewards_vault_tokens,
+                "rewards_crvusd": rewards_crvusd,
+                "price_per_share": pps[vault],
+            },
+        )
+        data[name] = section_entry(rewards_crvusd, prev_rewards_crvusd, prev_week)
+
+    return data
+
+
+def section_entry(rewards_crvusd: float, prev_rewards_crvusd: float | None, distributor_week: int) -> dict[str, Any]:
+    """One distributor's section data: its last week's rewards against the week before's, if known."""
+    wow_pct = None
+    if prev_rewards_crvusd:
+        wow_pct = ((rewards_crvusd - prev_rewards_crvusd) / prev_rewards_crvusd) * 100
+    return {
+        "rewards_crvusd": rewards_crvusd,
+        "prev_rewards_crvusd": prev_rewards_crvusd,
+        "wow_pct": wow_pct,
+        "distributor_week": distributor_week,
+    }
+
+
+def get_cached_data() -> tuple[int, int, dict[str, Any]] | None:
+    """(week, year, section data) rebuilt from each distributor's latest weekly cache entry and, if cached, the entry
+    for the distributor week before. None unless every distributor has an entry saved in the same week.
+    """
+    data = {}
+    saved = set()
+    for name in DISTRIBUTORS:
+        entry = load_cache(name)
+        if entry is None:
+            return None
+        saved.add((entry["week"], entry["year"]))
+        prev = next(
+            (e for e in load_cache_history(name) if e.get("distributor_week") == entry["distributor_week"] - 1), None
+        )
+        # Both weeks at the latest pricePerShare, as a live fetch prices them
+        prev_rewards_crvusd = prev["rewards_vault_tokens"] * entry["price_per_share"] if prev else None
+        data[name] = section_entry(entry["rewards_crvusd"], prev_rewards_crvusd, entry["distributor_week"])
+    if len(saved) != 1:
+        return None
+    week, year = saved.pop()
+    return week, year, data
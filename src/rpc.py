@@ -0,0 +1,384 @@
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, cast
+from urllib.parse import urlsplit
+
+import requests
+from web3 import HTTPProvider
+from web3._utils.batching import sort_batch_response_by_response_ids
+from web3.types import RPCEndpoint, RPCResponse
+
+import store
+import tracing
+from utils import (
+    CHAIN_TIMEOUT,
+    MULTICALL3_ADDRESS,
+    RPC_BACKOFF,
+    RPC_BACKOFF_MAX,
+    RPC_BREAKER_COOLDOWN,
+    RPC_BREAKER_FAILURES,
+    RPC_HEDGE_DEFAULT_DELAY,
+    RPC_HEDGE_MIN_DELAY,
+    RPC_HEDGE_PERCENTILE,
+    RPC_POOL_SIZE,
+    RPC_PRIORITY,
+    RPC_RATE_BURST,
+    RPC_RATE_UNIT,
+    RPC_RETRIES,
+)
+
+LATENCY_ALPHA = 0.2  # weight of the newest sample in an endpoint's moving latency
+LATENCY_SAMPLES = 100  # recent latencies kept per endpoint for its hedge delay
+
+# HTTP statuses that mean the endpoint (not the request) is unhealthy
+ENDPOINT_ERRORS = {408, 429, 500, 502, 503, 504}
+
+# Providers that answer over-limit requests with HTTP 200 and a JSON-RPC error instead of a 429. -32005 ("limit
+# exceeded") also covers other limits, e.g. eth_getLogs over Infura's 10000 results, so it needs a rate limit message.
+RPC_ERROR = re.compile(rb'"error"\s*:\s*\{([^}]*)')
+RPC_ERROR_CODE = re.compile(rb'"code"\s*:\s*(-?\d+)')
+RATE_LIMIT_MESSAGE = re.compile(rb"(?i)\brate\b|rate.?limit|too many requests")
+
+# Compute units per method, as priced by Alchemy; methods not listed cost the default
+COMPUTE_UNITS = {"eth_blockNumber": 10, "eth_call": 26, "eth_getBlockByNumber": 16, "eth_getLogs": 75}
+DEFAULT_COMPUTE_UNITS = 20
+
+
+def throttle_error(content: bytes) -> bool:
+    """Whether a JSON-RPC response reports the endpoint's rate limit."""
+    for error in RPC_ERROR.finditer(content[:512]):
+        code = RPC_ERROR_CODE.search(error.group(1))
+        if code is not None and (
+            code.group(1) == b"429" or (code.group(1) == b"-32005" and RATE_LIMIT_MESSAGE.search(error.group(1)))
+        ):
+            return True
+    return False
+
+
+def request_cost(methods: list[str]) -> float:
+    """Rate limit tokens spent by one HTTP request carrying methods (several for a batch)."""
+    if RPC_RATE_UNIT == "cu":
+        return float(sum(COMPUTE_UNITS.get(method, DEFAULT_COMPUTE_UNITS) for method in methods))
+    return float(len(methods))
+
+
+def priority() -> int:
+    """Rate limiter priority of the current section, lower first: its position in RPC_PRIORITY."""
+    section = tracing.current_section()
+    return RPC_PRIORITY.index(section) if section in RPC_PRIORITY else len(RPC_PRIORITY)
+
+
+class Throttled(requests.HTTPError):
+    """The endpoint rejected a request for exceeding the plan's rate limit."""
+
+    def __init__(self, message: str, retry_after: float, response: requests.Response) -> None:
+        super().__init__(message, response=response)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket shared by every request to one chain, refilled at rate tokens per second.
+
+    Requests that can't be served wait in a queue ordered by priority, then arrival, so a busy section can't
+    starve a more important one. pause() holds every request back, e.g. after the provider throttled one.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.queue: list[tuple[int, int]] = []  # heap of (priority, ticket)
+        self.tickets = itertools.count()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, cost: float, rank: int) -> None:
+        """Block until the request is first in the queue and cost tokens are available, then spend them.
+        A request costing more than the whole bucket goes out once the bucket is full.
+        """
+        cost = min(cost, self.capacity)
+        with self.condition:
+            if self.rate <= 0 and time.monotonic() >= self.paused_until and not self.queue:
+                return
+            entry = (rank, next(self.tickets))
+            heapq.heappush(self.queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if self.queue[0] != entry:
+                        self.condition.wait()
+                        continue
+                    wait = self.paused_until - now
+                    if self.rate > 0:
+                        wait = max(wait, (cost - self.tokens) / self.rate)
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+            except BaseException:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+                raise
+            heapq.heappop(self.queue)
+            if self.rate > 0:
+                self.tokens -= cost
+            self.condition.notify_all()
+
+    def try_acquire(self, cost: float) -> bool:
+        """Spend cost tokens if no request is waiting and they are available now, without blocking."""
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            if self.queue or now < self.paused_until:
+                return False
+            if self.rate > 0:
+                if self.tokens < min(cost, self.capacity):
+                    return False
+                self.tokens -= min(cost, self.capacity)
+            return True
+
+    def pause(self, seconds: float) -> None:
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Endpoint:
+    """One RPC URL: a keep-alive session, its moving latency and its circuit breaker."""
+
+    def __init__(self, chain: str, url: str) -> None:
+        self.chain = chain
+        self.url = url
+        self.host = urlsplit(url).netloc  # URLs may carry API keys in the path, hosts don't
+        self.session = requests.Session()
+        self.session.mount(url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE))
+        self.session.headers["Content-Type"] = "application/json"
+        self.lock = threading.Lock()
+        self.latency: float | None = None  # EWMA, seconds
+        self.samples: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.failures = 0  # in a row
+        self.open_until = 0.0  # circuit open (endpoint skipped) until this monotonic time
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def hedge_delay(self) -> float:
+        """How long to wait on this endpoint before duplicating the request: its recent RPC_HEDGE_PERCENTILE."""
+        with self.lock:
+            if not self.samples:
+                return RPC_HEDGE_DEFAULT_DELAY
+            ordered = sorted(self.samples)
+        rank = min(len(ordered) - 1, int(len(ordered) * RPC_HEDGE_PERCENTILE / 100))
+        return max(RPC_HEDGE_MIN_DELAY, ordered[rank])
+
+    def post(self, data: bytes) -> bytes:
+        start = time.monotonic()
+        try:
+            with tracing.span("rpc_endpoint", f"{self.chain} {self.host}") as call:
+                call.sent = len(data)
+                response = self.session.post(self.url, data=data, timeout=CHAIN_TIMEOUT)
+                call.received = len(response.content)
+            if response.status_code == 429 or throttle_error(response.content):
+                # Over the plan's rate limit: the endpoint is healthy, the caller has to slow down
+                raise Throttled(f"{self.host} throttled the request", retry_after(response), response)
+            if response.status_code in ENDPOINT_ERRORS:
+                response.raise_for_status()
+        except Throttled:
+            raise
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - start)
+        # Other 4xx (e.g. payload too large) are about the request, not the endpoint
+        response.raise_for_status()
+        return response.content
+
+    def record_success(self, seconds: float) -> None:
+        with self.lock:
+            self.latency = (
+                seconds if self.latency is None else LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.latency
+            )
+            self.samples.append(seconds)
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= RPC_BREAKER_FAILURES:
+                # Half-open after the cooldown: the next request tries it again, one more failure reopens it
+                self.open_until = time.monotonic() + RPC_BREAKER_COOLDOWN
+
+
+def retry_after(response: requests.Response) -> float:
+    """Seconds the Retry-After header asks for, 0 if absent or given as a date."""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", 0)))
+    except ValueError:
+        return 0.0
+
+
+class EndpointPool:
+    """All RPC endpoints of one chain. Requests go to the fastest available endpoint and are hedged.
+
+    If the response takes longer than that endpoint's recent p95 latency, the same request is also sent to
+    the next fastest endpoint, and so on; the first response wins. Failed requests move on to the next endpoint.
+    Only read methods are sent, so duplicates are harmless.
+
+    Every request, hedges included, spends tokens from the chain's RateLimiter; hedges are skipped while the
+    bucket is empty. When endpoints throttle a request, the whole chain backs off before it is retried.
+    """
+
+    def __init__(self, chain: str, urls: list[str], rate: float = 0.0) -> None:
+        self.chain = chain
+        self.endpoints = [Endpoint(chain, url) for url in urls]
+        self.limiter = RateLimiter(rate, RPC_RATE_BURST)
+        self.executor = ThreadPoolExecutor(max_workers=RPC_POOL_SIZE * len(urls), thread_name_prefix=f"rpc-{chain}")
+
+    def ranked(self) -> list[Endpoint]:
+        """Available endpoints, fastest first (unmeasured ones are tried first). If every circuit is open,
+        all endpoints, soonest to close first: a run never fails without trying.
+        """
+        now = time.monotonic()
+        available = [e for e in self.endpoints if e.available(now)]
+        if not available:
+            return sorted(self.endpoints, key=lambda e: e.open_until)
+        return sorted(available, key=lambda e: -1.0 if e.latency is None else e.latency)
+
+    def post(self, data: bytes, cost: float = 1.0) -> bytes:
+        """Send one JSON-RPC request (cost rate limit tokens), retrying with backoff while it is throttled."""
+        rank = priority()
+        attempt = 0
+        while True:
+            try:
+                return self.race(data, cost, rank)
+            except Throttled as e:
+                if attempt == RPC_RETRIES:
+                    raise
+                # Full jitter, so requests throttled together don't come back together
+                backoff = random.uniform(0, min(RPC_BACKOFF_MAX, RPC_BACKOFF * 2**attempt))
+                self.limiter.pause(max(e.retry_after, backoff))
+                attempt += 1
+
+    def acquire(self, cost: float, rank: int) -> None:
+        if self.limiter.try_acquire(cost):
+            return
+        with tracing.span("rpc_wait", self.chain):
+            self.limiter.acquire(cost, rank)
+
+    def race(self, data: bytes, cost: float, rank: int) -> bytes:
+        candidates = self.ranked()
+        pending: dict[Future[bytes], Endpoint] = {}
+        errors: list[Exception] = []
+
+        def launch() -> float:
+            endpoint = candidates.pop(0)
+            pending[self.executor.submit(tracing.bind(endpoint.post), data)] = endpoint
+            return endpoint.hedge_delay()
+
+        self.acquire(cost, rank)
+        delay = launch()
+        while pending:
+            done, _ = wait(pending, timeout=delay if candidates else None, return_when=FIRST_COMPLETED)
+            if not done:
+                if self.limiter.try_acquire(cost):
+                    delay = launch()  # Hedge: the request is slow, race it on the next endpoint
+                else:
+                    delay = RPC_HEDGE_MIN_DELAY  # No tokens to spare for a duplicate yet
+                continue
+            for future in done:
+                del pending[future]
+                try:
+                    return future.result()
+                except Throttled as e:
+                    errors.append(e)  # Another endpoint may be on a different plan
+                except requests.HTTPError as e:
+                    if e.response is not None and e.response.status_code not in ENDPOINT_ERRORS:
+                        raise  # The request itself was rejected, other endpoints would too
+                    errors.append(e)
+                except Exception as e:
+                    errors.append(e)
+            if not pending and candidates:
+                self.acquire(cost, rank)
+                delay = launch()
+        # Throttling is transient: prefer it over other errors so the caller backs off and retries
+        throttled = [e for e in errors if isinstance(e, Throttled)]
+        raise max(throttled, key=lambda e: e.retry_after) if throttled else errors[-1]
+
+
+class CachingProvider(HTTPProvider):
+    """HTTPProvider that memoizes eth_call results at a fixed block number on disk.
+
+    With a snapshot block, calls at "latest" are pinned to it, so every read in the run is cacheable.
+    Multicall3 batches are not cached whole: their calldata depends on which calls the run still needed,
+    so multicall caches each call inside them instead.
+    eth_chainId, which web3 asks for before each contract call, is answered from config.
+    Requests go out through the chain's EndpointPool.
+    Requests that reach the endpoint, and cache hits, are traced per chain and method.
+    """
+
+    def __init__(self, chain: str, chain_id: int, block: int | None, pool: EndpointPool, **kwargs: Any) -> None:
+        super().__init__(pool.endpoints[0].url, **kwargs)
+        self.chain = chain
+        self.chain_id = chain_id
+        self.block = block
+        self.pool = pool
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 0, "result": hex(self.chain_id)}
+        if method != "eth_call":
+            return super().make_request(method, params)
+
+        tx, block_id = params[0], params[1] if len(params) > 1 else "latest"
+        if block_id == "latest" and self.block is not None:
+            block_id = hex(self.block)
+        if not isinstance(block_id, str) or not block_id.startswith("0x"):
+            # Tags and block hashes may point at different state on the next run
+            return super().make_request(method, [tx, block_id, *params[2:]])
+
+        block = int(block_id, 16)
+        target = str(tx["to"]).lower()
+        if target == MULTICALL3_ADDRESS.lower():
+            return super().make_request(method, [tx, block_id, *params[2:]])
+        calldata = str(tx.get("data") or tx.get("input") or "0x")
+        result = store.get_call(self.chain, block, target, calldata)
+        if result is not None:
+            with tracing.span("rpc_cache", f"{self.chain} eth_call") as call:
+                call.received = len(result)
+            return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+        response = super().make_request(method, [tx, block_id, *params[2:]])
+        if "result" in response and not response.get("error"):
+            store.put_call(self.chain, block, target, calldata, str(response["result"]))
+        return response
+
+    def _make_request(self, method: RPCEndpoint, request_data: bytes) -> bytes:
+        with tracing.span("rpc", f"{self.chain} {method}") as call:
+            call.sent = len(request_data)
+            response = self.pool.post(request_data, request_cost([method]))
+            call.received = len(response)
+            return response
+
+    def make_batch_request(self, batch_requests: list[tuple[RPCEndpoint, Any]]) -> list[RPCResponse] | RPCResponse:
+        methods = sorted({method for method, _ in batch_requests})
+        with tracing.span("rpc", f"{self.chain} batch {','.join(methods)}") as call:
+            request_data = self.encode_batch_rpc_request(batch_requests)
+            call.sent = len(request_data)
+            raw_response = self.pool.post(request_data, request_cost([method for method, _ in batch_requests]))
+            call.received = len(raw_response)
+        response = self.decode_rpc_response(raw_response)
+        if not isinstance(response, list):
+            # RPC errors return only one response with the error object
+            return response
+        return cast(list[RPCResponse], sort_batch_response_by_response_ids(response))
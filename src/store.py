@@ -0,0 +1,368 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+DATA_DIR = Path(os.getenv("DATA_DIR") or Path(__file__).parent.parent / "data")
+DB_PATH = DATA_DIR / "cache.db"
+HISTORY_PATH = DATA_DIR / "history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history.weekly (
+    name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, year, week)
+);
+CREATE TABLE IF NOT EXISTS history.migrated (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS snapshots (
+    name TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (name, chain)
+);
+CREATE TABLE IF NOT EXISTS eth_calls (
+    chain TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    calldata TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (chain, block, target, calldata)
+);
+CREATE TABLE IF NOT EXISTS call_results (
+    chain TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    calldata BLOB NOT NULL,
+    success INTEGER NOT NULL,
+    result BLOB NOT NULL,
+    PRIMARY KEY (chain, block, target, calldata)
+);
+CREATE TABLE IF NOT EXISTS vault_meta (
+    chain TEXT NOT NULL,
+    address TEXT NOT NULL,
+    vault_type INTEGER NOT NULL,
+    name TEXT,
+    asset TEXT,
+    decimals INTEGER,
+    PRIMARY KEY (chain, address)
+);
+CREATE TABLE IF NOT EXISTS feed_meta (
+    chain TEXT NOT NULL,
+    address TEXT NOT NULL,
+    decimals INTEGER NOT NULL,
+    PRIMARY KEY (chain, address)
+);
+CREATE TABLE IF NOT EXISTS registry_index_cursors (
+    chain TEXT NOT NULL,
+    registry TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (chain, registry)
+);
+CREATE TABLE IF NOT EXISTS registry_index (
+    chain TEXT NOT NULL,
+    registry TEXT NOT NULL,
+    address TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (chain, registry, address)
+);
+CREATE TABLE IF NOT EXISTS block_times (
+    chain TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (chain, block)
+);
+"""
+
+_local = threading.local()  # sqlite3 connections can't be shared across threads
+_migrated: set[str] = set()
+
+
+def connect() -> sqlite3.Connection:
+    conn: sqlite3.Connection | None = getattr(_local, "conn", None)
+    if conn is None:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # The weekly history is tracked in git, so it keeps a rollback journal: the file is whole after each commit
+        conn.execute("ATTACH DATABASE ? AS history", (str(HISTORY_PATH),))
+        conn.execute("PRAGMA history.journal_mode=DELETE")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def json_path(name: str) -> Path:
+    return DATA_DIR / f"{name}_cache.json"
+
+
+def migrate(conn: sqlite3.Connection, name: str) -> None:
+    """Import the legacy data/<name>_cache.json history once. Entries already in the store win."""
+    if name in _migrated:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM history.migrated WHERE name = ?", (name,)).fetchone() is None:
+            path = json_path(name)
+            history: Any = json.loads(path.read_text()) if path.exists() else []
+            if isinstance(history, dict):
+                history = [history]
+            conn.executemany(
+                "INSERT OR IGNORE INTO history.weekly (name, year, week, data) VALUES (?, ?, ?, ?)",
+                [(name, e["year"], e["week"], json.dumps(e)) for e in history],
+            )
+            conn.execute("INSERT INTO history.migrated (name) VALUES (?)", (name,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    _migrated.add(name)
+
+
+def query(name: str, sql: str, *params: Any) -> list[dict[str, Any]]:
+    conn = connect()
+    migrate(conn, name)
+    return [dict(json.loads(row[0])) for row in conn.execute(sql, (name, *params))]
+
+
+def get(name: str, year: int, week: int) -> dict[str, Any] | None:
+    rows = query(name, "SELECT data FROM history.weekly WHERE name = ? AND year = ? AND week = ?", year, week)
+    return rows[0] if rows else None
+
+
+def latest(name: str, year: int | None = None) -> dict[str, Any] | None:
+    """Most recent entry, optionally within one year."""
+    if year is None:
+        rows = query(name, "SELECT data FROM history.weekly WHERE name = ? ORDER BY year DESC, week DESC LIMIT 1")
+    else:
+        rows = query(
+            name, "SELECT data FROM history.weekly WHERE name = ? AND year = ? ORDER BY week DESC LIMIT 1", year
+        )
+    return rows[0] if rows else None
+
+
+def history(name: str) -> list[dict[str, Any]]:
+    return query(name, "SELECT data FROM history.weekly WHERE name = ? ORDER BY year, week")
+
+
+def upsert(name: str, data: dict[str, Any]) -> None:
+    """Insert or atomically replace the entry for data's (year, week)."""
+    conn = connect()
+    migrate(conn, name)
+    conn.execute(
+        "INSERT OR REPLACE INTO history.weekly (name, year, week, data) VALUES (?, ?, ?, ?)",
+        (name, data["year"], data["week"], json.dumps(data)),
+    )
+
+
+def upsert_many(name: str, rows: list[dict[str, Any]]) -> None:
+    """Insert or replace the entries for each row's (year, week), in one transaction."""
+    conn = connect()
+    migrate(conn, name)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO history.weekly (name, year, week, data) VALUES (?, ?, ?, ?)",
+            [(name, row["year"], row["week"], json.dumps(row)) for row in rows],
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def export(name: str) -> None:
+    """Write name's history to data/<name>_cache.json, for reading and diffing; the store stays authoritative."""
+    rows = history(name)
+    with tempfile.NamedTemporaryFile("w", dir=DATA_DIR, delete=False) as tmp:
+        tmp.write(json.dumps(rows, indent=2))
+    os.replace(tmp.name, json_path(name))
+
+
+def pin_snapshot_block(name: str, chain: str, block: int) -> int:
+    """Pin block for chain in snapshot name and return the pinned block; the first run to pin wins."""
+    conn = connect()
+    conn.execute("INSERT OR IGNORE INTO snapshots (name, chain, block) VALUES (?, ?, ?)", (name, chain, block))
+    row = conn.execute("SELECT block FROM snapshots WHERE name = ? AND chain = ?", (name, chain)).fetchone()
+    return int(row[0])
+
+
+def get_snapshot_block(name: str, chain: str) -> int | None:
+    row = connect().execute("SELECT block FROM snapshots WHERE name = ? AND chain = ?", (name, chain)).fetchone()
+    return int(row[0]) if row else None
+
+
+def get_call(chain: str, block: int, target: str, calldata: str) -> str | None:
+    row = (
+        connect()
+        .execute(
+            "SELECT result FROM eth_calls WHERE chain = ? AND block = ? AND target = ? AND calldata = ?",
+            (chain, block, target, calldata),
+        )
+        .fetchone()
+    )
+    return str(row[0]) if row else None
+
+
+def put_call(chain: str, block: int, target: str, calldata: str, result: str) -> None:
+    connect().execute(
+        "INSERT OR REPLACE INTO eth_calls (chain, block, target, calldata, result) VALUES (?, ?, ?, ?, ?)",
+        (chain, block, target, calldata, result),
+    )
+
+
+def get_results(
+    chain: str, block: int, calls: list[tuple[str, bytes]]
+) -> dict[tuple[str, bytes], tuple[bool, memoryview]]:
+    """Stored (success, returnData) of the calls made at block, by (target, calldata)."""
+    conn = connect()
+    found = {}
+    for target, calldata in dict.fromkeys(calls):
+        row = conn.execute(
+            "SELECT success, result FROM call_results WHERE chain = ? AND block = ? AND target = ? AND calldata = ?",
+            (chain, block, target.lower(), calldata),
+        ).fetchone()
+        if row is not None:
+            found[(target, calldata)] = (bool(row[0]), memoryview(row[1]))
+    return found
+
+
+def put_results(chain: str, block: int, results: dict[tuple[str, bytes], tuple[bool, memoryview]]) -> None:
+    connect().executemany(
+        "INSERT OR REPLACE INTO call_results (chain, block, target, calldata, success, result) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (chain, block, target.lower(), calldata, success, bytes(data))
+            for (target, calldata), (success, data) in results.items()
+        ],
+    )
+
+
+def get_block_time(chain: str, block: int) -> int | None:
+    row = (
+        connect().execute("SELECT timestamp FROM block_times WHERE chain = ? AND block = ?", (chain, block)).fetchone()
+    )
+    return int(row[0]) if row else None
+
+
+def put_block_time(chain: str, block: int, timestamp: int) -> None:
+    connect().execute(
+        "INSERT OR REPLACE INTO block_times (chain, block, timestamp) VALUES (?, ?, ?)", (chain, block, timestamp)
+    )
+
+
+def block_bounds(chain: str, timestamp: int) -> tuple[tuple[int, int] | None, tuple[int, int] | None]:
+    """Closest known (block, timestamp) at or before timestamp, and closest known one after it."""
+    conn = connect()
+    below = conn.execute(
+        "SELECT block, timestamp FROM block_times WHERE chain = ? AND timestamp <= ? ORDER BY block DESC LIMIT 1",
+        (chain, timestamp),
+    ).fetchone()
+    above = conn.execute(
+        "SELECT block, timestamp FROM block_times WHERE chain = ? AND timestamp > ? ORDER BY block LIMIT 1",
+        (chain, timestamp),
+    ).fetchone()
+    return (tuple(below) if below else None), (tuple(above) if above else None)
+
+
+def vault_meta(chain: str) -> dict[str, dict[str, Any]]:
+    """Immutable fields of every vault seen on chain, by address."""
+    rows = connect().execute(
+        "SELECT address, vault_type, name, asset, decimals FROM vault_meta WHERE chain = ?", (chain,)
+    )
+    return {
+        row[0]: {"address": row[0], "vault_type": row[1], "name": row[2], "asset": row[3], "decimals": row[4]}
+        for row in rows
+    }
+
+
+def put_vault_meta(chain: str, vaults: list[dict[str, Any]]) -> None:
+    connect().executemany(
+        "INSERT OR REPLACE INTO vault_meta (chain, address, vault_type, name, asset, decimals) VALUES (?, ?, ?, ?, ?, ?)",
+        [(chain, v["address"], v["vault_type"], v["name"], v["asset"], v["decimals"]) for v in vaults],
+    )
+
+
+def feed_decimals(chain: str) -> dict[str, int]:
+    """decimals() of every price feed read on chain, by address."""
+    rows = connect().execute("SELECT address, decimals FROM feed_meta WHERE chain = ?", (chain,))
+    return {row[0]: int(row[1]) for row in rows}
+
+
+def put_feed_decimals(chain: str, decimals: dict[str, int]) -> None:
+    connect().executemany(
+        "INSERT OR REPLACE INTO feed_meta (chain, address, decimals) VALUES (?, ?, ?)",
+        [(chain, address, value) for address, value in decimals.items()],
+    )
+
+
+def registry_cursors(chain: str) -> dict[str, int]:
+    """Last block processed for each registry on chain."""
+    rows = connect().execute("SELECT registry, block FROM registry_index_cursors WHERE chain = ?", (chain,))
+    return {row[0]: int(row[1]) for row in rows}
+
+
+def endorsed_vaults(chain: str) -> list[tuple[str, str]]:
+    """(vault, registry) of every endorsed vault on chain, in the order they were endorsed."""
+    rows = connect().execute(
+        "SELECT address, registry FROM registry_index WHERE chain = ? ORDER BY block, rowid", (chain,)
+    )
+    return [(row[0], row[1]) for row in rows]
+
+
+def update_registry_index(
+    chain: str,
+    changes: list[tuple[bool, str, str, int]],
+    cursors: dict[str, int],
+    replaced: list[str] | None = None,
+) -> None:
+    """Apply (endorsed, vault, registry, block) changes in order and advance the cursors, atomically.
+
+    Entries of the replaced registries are dropped first, for registries whose changes are a full enumeration.
+    A vault endorsed anew (or again, after a removal) has its cached metadata dropped, to be read afresh.
+    """
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        indexed = set(conn.execute("SELECT registry, address FROM registry_index WHERE chain = ?", (chain,)))
+        conn.executemany(
+            "DELETE FROM registry_index WHERE chain = ? AND registry = ?",
+            [(chain, registry) for registry in replaced or []],
+        )
+        for endorsed, vault, registry, block in changes:
+            if endorsed:
+                conn.execute(
+                    "INSERT OR IGNORE INTO registry_index (chain, registry, address, block) VALUES (?, ?, ?, ?)",
+                    (chain, registry, vault, block),
+                )
+                if (registry, vault) not in indexed:
+                    conn.execute("DELETE FROM vault_meta WHERE chain = ? AND address = ?", (chain, vault))
+                    indexed.add((registry, vault))
+            else:
+                conn.execute(
+                    "DELETE FROM registry_index WHERE chain = ? AND registry = ? AND address = ?",
+                    (chain, registry, vault),
+                )
+                indexed.discard((registry, vault))
+        conn.executemany(
+            "INSERT OR REPLACE INTO registry_index_cursors (chain, registry, block) VALUES (?, ?, ?)",
+            [(chain, registry, block) for registry, block in cursors.items()],
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the weekly history to data/<name>_cache.json files.")
+    parser.add_argument("names", nargs="*", help="histories to export (default: those with a data/<name>_cache.json)")
+    args = parser.parse_args()
+
+    for name in args.names or sorted(path.name.removesuffix("_cache.json") for path in DATA_DIR.glob("*_cache.json")):
+        export(name)
+        print(f"Exported {name} to {json_path(name)}")
@@ -0,0 +1,90 @@
+import mmap
+from array import array
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from http_cache import http_open
+from store import DATA_DIR
+from utils import LLAMA_API, iter_json_array
+
+DEFI_TVL_URL = f"{LLAMA_API}/v2/historicalChainTvl"
+SERIES_PATH = DATA_DIR / "defi_tvl.bin"
+
+# Each point is two native float64s: (unix timestamp, TVL in USD)
+POINT_SIZE = 2 * array("d").itemsize
+
+
+@contextmanager
+def open_series(path: Path = SERIES_PATH) -> Iterator[memoryview]:
+    """Memory-map the series as a flat float64 view: [ts0, tvl0, ts1, tvl1, ...]."""
+    if not path.exists() or path.stat().st_size < POINT_SIZE:
+        yield memoryview(array("d"))
+        return
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm).cast("d")
+        try:
+            yield view
+        finally:
+            view.release()
+
+
+def tail(path: Path = SERIES_PATH) -> tuple[float, float] | None:
+    """Most recent (timestamp, tvl) point, or None if the series is empty."""
+    with open_series(path) as view:
+        if not view:
+            return None
+        return view[-2], view[-1]
+
+
+def update_series(path: Path = SERIES_PATH) -> None:
+    """Append the points newer than the stored tail, refreshing the tail point itself.
+
+    DefiLlama has no range query for this endpoint, so the (HTTP cached) response is streamed and
+    everything up to the tail is skipped without being kept in memory.
+    """
+    last = tail(path)
+    last_ts = last[0] if last else float("-inf")
+
+    new_points = array("d")
+    tail_value = None
+    with http_open(DEFI_TVL_URL) as f:
+        for point in iter_json_array(f):
+            ts = float(point["date"])
+            if ts > last_ts:
+                new_points.extend((ts, float(point["tvl"])))
+            elif ts == last_ts:
+                tail_value = float(point["tvl"])
+
+    if tail_value is None and not new_points:
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("r+b" if path.exists() else "wb") as f:
+        if last and tail_value is not None:
+            # The current day's point is updated intraday
+            f.seek(-POINT_SIZE, 2)
+            array("d", (last_ts, tail_value)).tofile(f)
+        f.seek(0, 2)
+        new_points.tofile(f)
+
+
+def value_at(ts: float, path: Path = SERIES_PATH) -> float | None:
+    """TVL of the last point at or before ts, looked up locally by binary search."""
+    with open_series(path) as view:
+        lo, hi = 0, len(view) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if view[2 * mid] <= ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return view[2 * lo - 1] if lo else None
+
+
+def latest_defi_tvl() -> float:
+    update_series()
+    last = tail()
+    if last is None:
+        raise ValueError("DeFi TVL series is empty")
+    return last[1]
@@ -0,0 +1,117 @@
+import contextvars
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, ParamSpec, TypeVar
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# Upper bounds (ms) of the latency histogram buckets; slower calls land in the last, open bucket
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Newsletter section the current call is made for, inherited by worker threads through bind()
+_section: contextvars.ContextVar[str] = contextvars.ContextVar("section", default="-")
+
+
+@dataclass
+class Call:
+    """One traced call. Instrumented code fills in sent/received bytes while it runs."""
+
+    kind: str  # http, http_cache, rpc, rpc_cache, rpc_endpoint, rpc_wait, multicall, section
+    target: str  # host, or chain and method
+    section: str
+    seconds: float = 0.0
+    sent: int = 0
+    received: int = 0
+    error: bool = False
+
+
+# Receivers of every finished call; tracing is a no-op while this is empty
+SINKS: list[Callable[[Call], None]] = []
+
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    """Attribute calls made inside the block to section name."""
+    token = _section.set(name)
+    try:
+        yield
+    finally:
+        _section.reset(token)
+
+
+def current_section() -> str:
+    return _section.get()
+
+
+def bind(fn: Callable[P, R]) -> Callable[P, R]:
+    """Wrap fn to run in a copy of the caller's context, so pool threads keep the caller's section."""
+    context = contextvars.copy_context()
+
+    def run(*args: P.args, **kwargs: P.kwargs) -> R:
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+@contextmanager
+def span(kind: str, target: str) -> Iterator[Call]:
+    """Time the block as one call and hand it to every sink."""
+    call = Call(kind, target, _section.get())
+    if not SINKS:
+        yield call
+        return
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.error = True
+        raise
+    finally:
+        call.seconds = time.perf_counter() - start
+        for sink in SINKS:
+            sink(call)
+
+
+class Profile:
+    """Sink aggregating calls by section, kind and target."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.stats: dict[tuple[str, str, str], dict[str, Any]] = {}
+
+    def __call__(self, call: Call) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(
+                (call.section, call.kind, call.target),
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "sent_bytes": 0,
+                    "received_bytes": 0,
+                    "latency_ms": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                },
+            )
+            stats["count"] += 1
+            stats["errors"] += call.error
+            stats["seconds"] += call.seconds
+            stats["max_seconds"] = max(stats["max_seconds"], call.seconds)
+            stats["sent_bytes"] += call.sent
+            stats["received_bytes"] += call.received
+            ms = call.seconds * 1000
+            stats["latency_ms"][next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if ms <= b), -1)] += 1
+
+    def report(self) -> dict[str, Any]:
+        """{section: {kind: {target: stats}}}, with histogram buckets labelled by upper bound."""
+        labels = [f"<={b}" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        report: dict[str, Any] = {}
+        with self.lock:
+            for (section_name, kind, target), stats in sorted(self.stats.items()):
+                entry = dict(stats, latency_ms=dict(zip(labels, stats["latency_ms"])))
+                report.setdefault(section_name, {}).setdefault(kind, {})[target] = entry
+        return report
@@ -1,75 +1,64 @@
 from typing import Any
-from urllib.request import urlopen
 
-from utils import fetch_eth_price, get_previous_week_data, get_week_and_year, save_cache
+from http_cache import http_get, http_open
+from timeseries import latest_defi_tvl
+from utils import (
+    LLAMA_API,
+    fetch_eth_price,
+    get_previous_week_data,
+    get_week_and_year,
+    iter_json_array,
+    load_cache,
+    save_cache,
+)
 
 CACHE_NAME = "tvl"
 
 
 def fetch_yearn_tvl() -> float:
-    with urlopen("https://api.llama.fi/tvl/yearn") as r:
-        return float(r.read().decode())
+    return float(http_get(f"{LLAMA_API}/tvl/yearn").decode())
 
 
 def fetch_defi_tvl() -> float:
-    import json
-
-    with urlopen("https://api.llama.fi/v2/historicalChainTvl") as r:
-        data: list[dict[str, Any]] = json.loads(r.read().decode())
-        return float(data[-1]["tvl"])
+    return latest_defi_tvl()
 
 
 def fetch_yield_aggregator_tvl() -> float:
-    import json
-
-    with urlopen("https://api.llama.fi/protocols") as r:
-        data: list[dict[str, Any]] = json.loads(r.read().decode())
-        return float(sum(p.get("tvl") or 0 for p in data if p.get("category") == "Yield Aggregator"))
-
-
-def get_data() -> dict[str, Any]:
-    week, year = get_week_and_year()
-    eth_price = fetch_eth_price()
-
-    yearn_tvl = fetch_yearn_tvl()
-    defi_tvl = fetch_defi_tvl()
-    ya_tvl = fetch_yield_aggregator_tvl()
-
-    tvl_eth = yearn_tvl / eth_price
+    # The payload lists every protocol; stream it so only one protocol is held in memory at a time
+    with http_open(f"{LLAMA_API}/protocols") as f:
+        return float(sum(p.get("tvl") or 0 for p in iter_json_array(f) if p.get("category") == "Yield Aggregator"))
+
+
+def section_data(entry: dict[str, Any], prev: dict[str, Any] | None, eth_price: float) -> dict[str, Any]:
+    """Section data from one week's cache entry, compared with the previous week's entry."""
+    yearn_tvl, tvl_eth, defi_tvl, ya_tvl = (
+        entry["tvl_usd"],
+        entry["tvl_eth"],
+        entry["defi_tvl_usd"],
+        entry["ya_tvl_usd"],
+    )
 
     defi_tvl_eth = defi_tvl / eth_price
     ya_tvl_eth = ya_tvl / eth_price
 
-    prev = get_previous_week_data(CACHE_NAME, week, year)
     if prev:
         wow_usd = (yearn_tvl - prev["tvl_usd"]) / prev["tvl_usd"] * 100
         wow_eth = (tvl_eth - prev["tvl_eth"]) / prev["tvl_eth"] * 100
-        defi_wow = (defi_tvl - prev["defi_tvl_usd"]) / prev["defi_tvl_usd"] * 100
-        ya_wow = (ya_tvl - prev["ya_tvl_usd"]) / prev["ya_tvl_usd"] * 100
+        defi_wow = (defi_tvl - prev["defi_tvl_usd"]) / prev["defi_tvl_usd"] * 100 if "defi_tvl_usd" in prev else None
+        # Backfilled weeks have no Yield Aggregator TVL, DefiLlama keeps no history of it
+        ya_wow = (ya_tvl - prev["ya_tvl_usd"]) / prev["ya_tvl_usd"] * 100 if "ya_tvl_usd" in prev else None
     else:
         wow_usd = None
         wow_eth = None
         defi_wow = None
         ya_wow = None
 
-    save_cache(
-        CACHE_NAME,
-        {
-            "week": week,
-            "year": year,
-            "tvl_usd": yearn_tvl,
-            "tvl_eth": tvl_eth,
-            "defi_tvl_usd": defi_tvl,
-            "ya_tvl_usd": ya_tvl,
-        },
-    )
-
     prev_defi_eth = prev["defi_tvl_usd"] / eth_price if prev and "defi_tvl_usd" in prev else None
     prev_ya_eth = prev["ya_tvl_usd"] / eth_price if prev and "ya_tvl_usd" in prev else None
 
     return {
-        "week": week,
-        "year": year,
+        "week": entry["week"],
+        "year": entry["year"],
         "tvl_usd": yearn_tvl,
         "tvl_eth": tvl_eth,
         "defi_tvl_usd": defi_tvl,
@@ -89,3 +78,33 @@ def get_data() -> dict[str, Any]:
         "defi_wow_pct": defi_wow,
         "ya_wow_pct": ya_wow,
     }
+
+
+def get_data() -> dict[str, Any]:
+    week, year = get_week_and_year()
+    eth_price = fetch_eth_price()
+
+    yearn_tvl = fetch_yearn_tvl()
+    defi_tvl = fetch_defi_tvl()
+    ya_tvl = fetch_yield_aggregator_tvl()
+
+    entry = {
+        "week": week,
+        "year": year,
+        "tvl_usd": yearn_tvl,
+        "tvl_eth": yearn_tvl / eth_price,
+        "defi_tvl_usd": defi_tvl,
+        "ya_tvl_usd": ya_tvl,
+    }
+    prev = get_previous_week_data(CACHE_NAME, week, year)
+    save_cache(CACHE_NAME, entry)
+    return section_data(entry, prev, eth_price)
+
+
+def get_cached_data() -> tuple[int, int, dict[str, Any]] | None:
+    """(week, year, section data) rebuilt from the latest weekly cache entry, or None if it is missing fields."""
+    entry = load_cache(CACHE_NAME)
+    if entry is None or not all(key in entry for key in ("tvl_eth", "defi_tvl_usd", "ya_tvl_usd")):
+        return None
+    prev = get_previous_week_data(CACHE_NAME, entry["week"], entry["year"])
+    return entry["week"], entry["year"], section_data(entry, prev, entry["tvl_usd"] / entry["tvl_eth"])
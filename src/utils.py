@@ -1,25 +1,129 @@
+import codecs
 import json
 import os
-from datetime import date
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import cache
 from pathlib import Path
-from typing import Any
-from urllib.request import urlopen
+from typing import TYPE_CHECKING, Any, BinaryIO
 
 from dotenv import load_dotenv
-from web3 import Web3
+
+import http_cache
+import store
+import tracing
+from http_cache import http_get
+
+# web3 takes about a second to import, so it is only loaded once an RPC section runs
+if TYPE_CHECKING:
+    from web3 import Web3
+    from web3.types import BlockIdentifier
+
+    from calls import Result
+    from rpc import EndpointPool
 
 load_dotenv()
 
-DATA_DIR = Path(__file__).parent.parent / "data"
 
-# Chain configs
-CHAINS = {
-    "mainnet": {"rpc": os.getenv("RPC_MAINNET", ""), "chain_id": 1},
-    "arbitrum": {"rpc": os.getenv("RPC_ARBITRUM", ""), "chain_id": 42161},
-    "base": {"rpc": os.getenv("RPC_BASE", ""), "chain_id": 8453},
-    "katana": {"rpc": os.getenv("RPC_KATANA", ""), "chain_id": 747474},
+def env_list(name: str) -> list[str]:
+    """Comma-separated values of environment variable name."""
+    return [value.strip() for value in os.getenv(name, "").split(",") if value.strip()]
+
+
+# Chain configs. Each RPC_* variable lists one or more endpoints, pooled per chain, and each RPC_RATE_* the
+# chain's rate limit in RPC_RATE_UNIT per second (0 = unlimited).
+CHAINS: dict[str, dict[str, Any]] = {
+    "mainnet": {
+        "rpcs": env_list("RPC_MAINNET"),
+        "rate": float(os.getenv("RPC_RATE_MAINNET") or 0),
+        "chain_id": 1,
+        "llama": "ethereum",
+    },
+    "arbitrum": {
+        "rpcs": env_list("RPC_ARBITRUM"),
+        "rate": float(os.getenv("RPC_RATE_ARBITRUM") or 0),
+        "chain_id": 42161,
+        "llama": "arbitrum",
+    },
+    "base": {
+        "rpcs": env_list("RPC_BASE"),
+        "rate": float(os.getenv("RPC_RATE_BASE") or 0),
+        "chain_id": 8453,
+        "llama": "base",
+    },
+    "katana": {
+        "rpcs": env_list("RPC_KATANA"),
+        "rate": float(os.getenv("RPC_RATE_KATANA") or 0),
+        "chain_id": 747474,
+        "llama": "katana",
+    },
 }
 
+# Concurrency and timeouts (seconds)
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", str(len(CHAINS))))
+CHAIN_TIMEOUT = float(os.getenv("CHAIN_TIMEOUT", "60"))
+FETCH_DEADLINE = float(os.getenv("FETCH_DEADLINE", "180"))
+
+# Each section's share of FETCH_DEADLINE, in seconds. A section that misses its deadline or fails is rendered from
+# its most recent stored data, marked stale.
+SECTION_DEADLINES = {
+    "tvl": float(os.getenv("DEADLINE_TVL", "60")),
+    "vaults": float(os.getenv("DEADLINE_VAULTS", "180")),
+    "rewards": float(os.getenv("DEADLINE_REWARDS", "90")),
+}
+
+# Daemon mode (generate.py serve): local HTTP endpoint, seconds between refreshes of each section, and seconds
+# before a failed refresh is retried
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", "8000"))
+REFRESH_INTERVALS = {
+    "tvl": float(os.getenv("REFRESH_TVL", "900")),
+    "vaults": float(os.getenv("REFRESH_VAULTS", "3600")),
+    "rewards": float(os.getenv("REFRESH_REWARDS", "3600")),
+}
+REFRESH_RETRY = float(os.getenv("REFRESH_RETRY", "60"))
+
+# Registry discovery: eth_getLogs block range per request, ranges per JSON-RPC batch, and batches in parallel,
+# and blocks behind the head the registry index stops at
+LOG_RANGE_BLOCKS = int(os.getenv("LOG_RANGE_BLOCKS", "50000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "20"))
+LOG_WORKERS = int(os.getenv("LOG_WORKERS", "4"))
+LOG_CONFIRMATIONS = int(os.getenv("LOG_CONFIRMATIONS", "64"))
+
+# RPC endpoint pools: keep-alive connections per endpoint, hedging after the primary's recent latency
+# percentile (or the default delay before it has samples), and a circuit breaker that skips an endpoint
+# for the cooldown after that many failures in a row
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "16"))
+RPC_HEDGE_PERCENTILE = float(os.getenv("RPC_HEDGE_PERCENTILE", "95"))
+RPC_HEDGE_MIN_DELAY = float(os.getenv("RPC_HEDGE_MIN_DELAY", "0.05"))
+RPC_HEDGE_DEFAULT_DELAY = float(os.getenv("RPC_HEDGE_DEFAULT_DELAY", "1"))
+RPC_BREAKER_FAILURES = int(os.getenv("RPC_BREAKER_FAILURES", "3"))
+RPC_BREAKER_COOLDOWN = float(os.getenv("RPC_BREAKER_COOLDOWN", "30"))
+
+# RPC rate limiting: a token bucket per chain holding RPC_RATE_BURST seconds of its rate, counted in requests
+# (each call of a batch is one) or compute units ("cu"). Requests waiting for tokens are served in section order
+# of RPC_PRIORITY, and throttled (429) requests are retried with exponential backoff.
+RPC_RATE_UNIT = os.getenv("RPC_RATE_UNIT", "requests")
+RPC_RATE_BURST = float(os.getenv("RPC_RATE_BURST", "1"))
+RPC_PRIORITY = env_list("RPC_PRIORITY") or ["rewards", "tvl", "vaults"]
+RPC_RETRIES = int(os.getenv("RPC_RETRIES", "5"))
+RPC_BACKOFF = float(os.getenv("RPC_BACKOFF", "0.5"))
+RPC_BACKOFF_MAX = float(os.getenv("RPC_BACKOFF_MAX", "30"))
+_pools: dict[str, "EndpointPool"] = {}  # Shared by every Web3 of a chain, so connections and latencies persist
+_pools_lock = threading.Lock()
+
+# Snapshot name: pins every eth_call to one block per chain and reuses results across runs
+RPC_SNAPSHOT = os.getenv("RPC_SNAPSHOT", "")
+_snapshot_lock = threading.Lock()
+
+# Multicall3 batching: max calls and calldata bytes per aggregate3, and chunks sent in parallel
+MULTICALL_MAX_CALLS = int(os.getenv("MULTICALL_MAX_CALLS", "400"))
+MULTICALL_MAX_BYTES = int(os.getenv("MULTICALL_MAX_BYTES", "64000"))
+MULTICALL_WORKERS = int(os.getenv("MULTICALL_WORKERS", "4"))
+
 # Contract addresses (same across all chains)
 REGISTRY_ADDRESSES = [
     "0xd40ecF29e001c76Dcc4cC0D9cd50520CE845B038",
@@ -28,22 +132,49 @@ REGISTRY_ADDRESSES = [
 APR_ORACLE_ADDRESS = "0x1981AD9F44F2EA9aDd2dC4AD7D075c102C70aF92"
 MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
+# DefiLlama base URLs (overridable to point at a local stand-in)
+LLAMA_API = os.getenv("LLAMA_API", "https://api.llama.fi")
+COINS_API = os.getenv("COINS_API", "https://coins.llama.fi")
+http_cache.TTLS.update(
+    {
+        f"{COINS_API}/prices/current/": 300,
+        f"{LLAMA_API}/tvl/": 900,
+        f"{LLAMA_API}/v2/historicalChainTvl": 3600,
+        f"{LLAMA_API}/protocols": 3600,
+    }
+)
+
+# Prices (coins.llama.fi), memoized per process for PRICE_TTL seconds
+ETH_PRICE_KEY = "coingecko:ethereum"
+PRICE_TTL = float(os.getenv("PRICE_TTL", "300"))
+PRICE_BATCH_SIZE = 100  # keys per request, keeps the URL short
+_price_cache: dict[str, tuple[float, float]] = {}  # key -> (price, fetched at)
+_price_lock = threading.Lock()
+
 # Token addresses
 WETH_ADDRESS = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
 WBTC_ADDRESS = "0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599"
 
 
-def get_week_and_year() -> tuple[int, int]:
+def first_friday(year: int) -> date:
+    day = date(year, 1, 1)
+    while day.weekday() != 4:  # 4 = Friday
+        day = day.replace(day=day.day + 1)
+    return day
+
+
+def get_week_and_year(today: date | None = None) -> tuple[int, int]:
     """Week number where week 1 is the first Friday of the year, plus year."""
-    today = date.today()
-    year_start = date(today.year, 1, 1)
-    first_friday = year_start
-    while first_friday.weekday() != 4:  # 4 = Friday
-        first_friday = first_friday.replace(day=first_friday.day + 1)
-    days_since = (today - first_friday).days
+    today = today or date.today()
+    days_since = (today - first_friday(today.year)).days
     return max(1, (days_since // 7) + 1), today.year
 
 
+def week_start(week: int, year: int) -> date:
+    """First day (a Friday) of the given week."""
+    return first_friday(year) + timedelta(weeks=week - 1)
+
+
 def is_previous_week(prev: dict[str, Any] | None, week: int, year: int) -> bool:
     if not prev:
         return False
@@ -56,76 +187,113 @@ def is_previous_week(prev: dict[str, Any] | None, week: int, year: int) -> bool:
 
 def load_cache(name: str) -> dict[str, Any] | None:
     """Load the most recent entry from cache."""
-    path = DATA_DIR / f"{name}_cache.json"
-    if path.exists():
-        data: Any = json.loads(path.read_text())
-        if isinstance(data, list) and data:
-            return dict(data[-1])
-        elif isinstance(data, dict):
-            return dict(data)
-    return None
+    return store.latest(name)
 
 
 def load_cache_history(name: str) -> list[dict[str, Any]]:
-    """Load all historical entries from cache."""
-    path = DATA_DIR / f"{name}_cache.json"
-    if path.exists():
-        data: Any = json.loads(path.read_text())
-        if isinstance(data, list):
-            return [dict(d) for d in data]
-        elif isinstance(data, dict):
-            return [dict(data)]
-    return []
+    """Load all historical entries from cache, oldest first."""
+    return store.history(name)
 
 
 def get_previous_week_data(name: str, week: int, year: int) -> dict[str, Any] | None:
-    """Get data from the previous week."""
-    history = load_cache_history(name)
-    for entry in history:
-        if entry.get("year") == year and entry.get("week") == week - 1:
-            return entry
-        if entry.get("year") == year - 1 and week == 1:
-            return entry
-    return None
+    """Get data from the previous week (the last week of the previous year for week 1)."""
+    if week == 1:
+        return store.latest(name, year - 1)
+    return store.get(name, year, week - 1)
 
 
 def save_cache(name: str, data: dict[str, Any]) -> None:
-    """Append data to cache history, avoiding duplicates for same week."""
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    path = DATA_DIR / f"{name}_cache.json"
-
-    history = load_cache_history(name)
-
-    # Remove existing entry for same week/year if present
-    history = [e for e in history if not (e.get("week") == data.get("week") and e.get("year") == data.get("year"))]
-
-    history.append(data)
-    path.write_text(json.dumps(history, indent=2))
+    """Upsert data into the cache history, replacing any entry for the same week."""
+    store.upsert(name, data)
 
 
 def fetch_json(url: str) -> dict[str, Any]:
-    with urlopen(url) as r:
-        return dict(json.loads(r.read().decode()))
+    return dict(json.loads(http_get(url).decode()))
+
+
+def iter_json_array(f: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array, reading f in chunks instead of all at once."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, eof = "", 0, False
+
+    def fill() -> None:
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    def skip(chars: str) -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def value() -> Any:
+        nonlocal pos
+        while True:
+            skip(" \t\r\n")
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if not eof and (end == len(buf) or buf[end] not in " \t\r\n,]"):
+                # A number cut off at the chunk boundary, e.g. "-3e" of "-3e+10"
+                fill()
+                continue
+            pos = end
+            return item
+
+    skip(" \t\r\n")
+    if buf[pos : pos + 1] != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    skip(" \t\r\n")
+    if buf[pos : pos + 1] == "]":
+        return
+
+    while True:
+        yield value()
+        skip(" \t\r\n")
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise ValueError(f"Expected ',' or ']' between JSON array elements, got {buf[pos]!r}")
+        pos += 1
+
+
+def fetch_prices(keys: Iterable[str]) -> dict[str, float]:
+    """Resolve llama coin keys (`chain:address` or `coingecko:id`) to USD prices.
+
+    Keys missing from the process cache (or older than PRICE_TTL) are fetched in batched requests.
+    Keys are matched case-insensitively and ones llama can't price are left out of the result.
+    """
+    wanted = {key.lower() for key in keys}
+    with _price_lock:
+        now = time.monotonic()
+        missing = sorted(k for k in wanted if k not in _price_cache or now - _price_cache[k][1] > PRICE_TTL)
+    # Fetched without the lock, so a slow request doesn't hold up other sections' lookups
+    fetched = {}
+    for i in range(0, len(missing), PRICE_BATCH_SIZE):
+        batch = missing[i : i + PRICE_BATCH_SIZE]
+        data = fetch_json(f"{COINS_API}/prices/current/{','.join(batch)}")
+        fetched.update({key.lower(): (float(coin["price"]), now) for key, coin in data["coins"].items()})
+    with _price_lock:
+        _price_cache.update(fetched)
+        return {k: _price_cache[k][0] for k in wanted if k in _price_cache}
 
 
 def fetch_eth_price() -> float:
-    data = fetch_json("https://coins.llama.fi/prices/current/coingecko:ethereum")
-    return float(data["coins"]["coingecko:ethereum"]["price"])
-
-
-def fetch_btc_price() -> float:
-    data = fetch_json("https://coins.llama.fi/prices/current/coingecko:bitcoin")
-    return float(data["coins"]["coingecko:bitcoin"]["price"])
-
-
-def fetch_sky_price() -> float:
-    data = fetch_json("https://coins.llama.fi/prices/current/ethereum:0x56072C95FAA701256059aa122697B133aDEd9279")
-    return float(data["coins"]["ethereum:0x56072C95FAA701256059aa122697B133aDEd9279"]["price"])
-
-
-def fetch_yyb_price() -> float:
-    data = fetch_json("https://coins.llama.fi/prices/current/ethereum:0x22222222aEA0076fCA927a3f44dc0B4FdF9479D6")
-    return float(data["coins"]["ethereum:0x22222222aEA0076fCA927a3f44dc0B4FdF9479D6"]["price"])
+    return fetch_prices([ETH_PRICE_KEY])[ETH_PRICE_KEY]
 
 
 def fmt_usd(val: float) -> str:
@@ -148,21 +316,155 @@ def fmt_pct(val: float | None) -> str:
 ABIS_DIR = Path(__file__).parent / "abis"
 
 
+@cache
 def load_abi(name: str) -> list[dict[str, Any]]:
+    """ABI of name, read from disk once per process. Callers must not mutate it."""
     return list(json.loads((ABIS_DIR / f"{name}.json").read_text()))
 
 
-def get_web3(chain: str) -> Web3:
-    rpc = CHAINS[chain]["rpc"]
-    if not rpc:
-        raise ValueError(f"RPC URL not configured for {chain}")
-    return Web3(Web3.HTTPProvider(str(rpc)))
+def get_pool(chain: str) -> "EndpointPool":
+    from rpc import EndpointPool
+
+    with _pools_lock:
+        if chain not in _pools:
+            urls = list(CHAINS[chain]["rpcs"])
+            if not urls:
+                raise ValueError(f"RPC URL not configured for {chain}")
+            _pools[chain] = EndpointPool(chain, urls, float(CHAINS[chain]["rate"]))
+        return _pools[chain]
 
 
-def multicall(w3: Web3, calls: list[tuple[str, bytes]]) -> list[tuple[bool, bytes]]:
-    """Execute multiple calls via Multicall3. Returns list of (success, returnData)."""
-    multicall_abi = load_abi("multicall3")
-    multicall_contract = w3.eth.contract(address=Web3.to_checksum_address(MULTICALL3_ADDRESS), abi=multicall_abi)
-    call_data = [(Web3.to_checksum_address(target), True, data) for target, data in calls]
-    results = multicall_contract.functions.aggregate3(call_data).call()
-    return [(r[0], r[1]) for r in results]
+def snapshot_block(chain: str, pool: "EndpointPool") -> int | None:
+    """Block every call on chain is pinned to in snapshot mode, resolved once and kept in the store."""
+    if not RPC_SNAPSHOT:
+        return None
+    from web3 import Web3
+
+    from rpc import CachingProvider
+
+    with _snapshot_lock:
+        block = store.get_snapshot_block(RPC_SNAPSHOT, chain)
+        if block is None:
+            head = Web3(CachingProvider(chain, int(CHAINS[chain]["chain_id"]), None, pool)).eth.block_number
+            block = store.pin_snapshot_block(RPC_SNAPSHOT, chain, head)
+        return block
+
+
+def get_web3(chain: str) -> "Web3":
+    from web3 import Web3
+
+    from rpc import CachingProvider
+
+    pool = get_pool(chain)
+    block = snapshot_block(chain, pool)
+    return Web3(CachingProvider(chain, int(CHAINS[chain]["chain_id"]), block, pool))
+
+
+def block_time(w3: "Web3") -> int:
+    """Timestamp of the snapshot block reads are pinned to (kept in the store), or the current time if unpinned."""
+    chain, block = getattr(w3.provider, "chain", None), getattr(w3.provider, "block", None)
+    if chain is None or block is None:
+        return int(time.time())
+    timestamp = store.get_block_time(chain, block)
+    if timestamp is None:
+        timestamp = int(w3.eth.get_block(block)["timestamp"])
+        store.put_block_time(chain, block, timestamp)
+    return timestamp
+
+
+def call3_size(data: bytes) -> int:
+    """ABI-encoded size of one Call3 tuple: offset, target, allowFailure, bytes offset/length, padded data."""
+    return 160 + (len(data) + 31) // 32 * 32
+
+
+def chunk_calls(calls: list[tuple[str, bytes]], max_calls: int, max_bytes: int) -> list[list[tuple[str, bytes]]]:
+    """Split calls into consecutive chunks within both the call count and calldata byte budgets."""
+    chunks: list[list[tuple[str, bytes]]] = []
+    chunk: list[tuple[str, bytes]] = []
+    chunk_bytes = 0
+    for call in calls:
+        size = call3_size(call[1])
+        if chunk and (len(chunk) >= max_calls or chunk_bytes + size > max_bytes):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(call)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def aggregate3(w3: "Web3", calls: list[tuple[str, bytes]], block: "BlockIdentifier" = "latest") -> list["Result"]:
+    """Send calls as one aggregate3, bisecting the batch when the provider rejects it.
+
+    Calldata is built and the response split by hand (see calls), skipping web3's ABI codec.
+    """
+    from calls import decode_aggregate3, encode_aggregate3
+
+    try:
+        response = w3.eth.call({"to": MULTICALL3_ADDRESS, "data": encode_aggregate3(calls)}, block)
+        return decode_aggregate3(response)
+    except Exception as e:
+        if len(calls) == 1 or not rejected(e):
+            raise
+        # Gas or response size caps: retry each half on its own
+        mid = len(calls) // 2
+        return aggregate3(w3, calls[:mid], block) + aggregate3(w3, calls[mid:], block)
+
+
+def rejected(e: Exception) -> bool:
+    """Whether the provider turned the request itself down (size or gas caps), so a smaller one may pass: a 4xx
+    other than throttling and timeouts, or a JSON-RPC error. Anything else, from unreachable endpoints to a result
+    that fails to decode, would fail the halves too."""
+    import requests
+    from web3.exceptions import ContractLogicError, Web3RPCError
+
+    from rpc import ENDPOINT_ERRORS, Throttled
+
+    if isinstance(e, Throttled):
+        return False
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is not None and 400 <= status < 500 and status not in ENDPOINT_ERRORS
+    return isinstance(e, (Web3RPCError, ContractLogicError))
+
+
+def multicall(w3: "Web3", calls: list[tuple[str, bytes]], block: "BlockIdentifier" = "latest") -> list["Result"]:
+    """Execute multiple calls via Multicall3 at block. Returns list of (success, returnData) in call order.
+
+    Calls are split into chunks of at most MULTICALL_MAX_CALLS calls and MULTICALL_MAX_BYTES of
+    calldata, sent concurrently. At a block number (or the snapshot block) each call's result is cached on its own,
+    so a rerun only sends the calls it hasn't made yet, however the batch around them changed.
+    """
+    chain = str(getattr(w3.provider, "chain", "unknown"))
+    pinned = block if isinstance(block, int) else getattr(w3.provider, "block", None) if block == "latest" else None
+
+    def run(chunk: list[tuple[str, bytes]]) -> list["Result"]:
+        # Traced end to end, so the time spent beyond the chain's rpc spans is ABI encoding and decoding
+        with tracing.span("multicall", chain) as call:
+            call.sent = sum(call3_size(data) for _, data in chunk)
+            results = aggregate3(w3, chunk, block if pinned is None else pinned)
+            call.received = sum(len(data) for _, data in results)
+            return results
+
+    def send(calls: list[tuple[str, bytes]]) -> list["Result"]:
+        chunks = chunk_calls(calls, MULTICALL_MAX_CALLS, MULTICALL_MAX_BYTES)
+        if len(chunks) <= 1:
+            return run(calls) if calls else []
+        with ThreadPoolExecutor(max_workers=min(MULTICALL_WORKERS, len(chunks))) as pool:
+            chunk_results = pool.map(tracing.bind(run), chunks)
+        return [result for results in chunk_results for result in results]
+
+    if pinned is None:
+        return send(calls)
+
+    cached = store.get_results(chain, pinned, calls)
+    if cached:
+        with tracing.span("rpc_cache", f"{chain} multicall") as call:
+            call.received = sum(len(data) for _, data in cached.values())
+    misses = [call for call in dict.fromkeys(calls) if call not in cached]
+    if misses:
+        fetched = dict(zip(misses, send(misses)))
+        store.put_results(chain, pinned, fetched)
+        cached.update(fetched)
+    return [cached[call] for call in calls]
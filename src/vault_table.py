@@ -0,0 +1,99 @@
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+
+class VaultTable:
+    """Scanned vaults as parallel NumPy columns, one row per vault, in scan order."""
+
+    def __init__(self, columns: Mapping[str, npt.NDArray[Any]]) -> None:
+        self.columns = dict(columns)
+
+    @classmethod
+    def from_rows(cls, rows: list[dict[str, Any]], crypto_assets: Iterable[str] = ()) -> "VaultTable":
+        """Build from scanned vault dicts (name, chain, chain_id, address, apr, asset, amount)."""
+        assets = np.array([row["asset"] for row in rows], dtype=str)
+        return cls(
+            {
+                "name": np.array([row["name"] for row in rows], dtype=str),
+                "chain": np.array([row["chain"] for row in rows], dtype=str),
+                "chain_id": np.array([row["chain_id"] for row in rows], dtype=np.int64),
+                "address": np.array([row["address"] for row in rows], dtype=str),
+                "apr": np.array([row["apr"] for row in rows], dtype=np.float64),
+                "asset": assets,
+                "amount": np.array([row["amount"] for row in rows], dtype=np.float64),
+                "crypto": np.isin(assets, list(crypto_assets)),
+                "tvl_usd": np.full(len(rows), np.nan),
+            }
+        )
+
+    def __len__(self) -> int:
+        return len(self.columns["apr"])
+
+    def __getitem__(self, column: str) -> npt.NDArray[Any]:
+        return self.columns[column]
+
+    def take(self, rows: npt.NDArray[Any]) -> "VaultTable":
+        """Subset by boolean mask or row indices."""
+        return VaultTable({name: col[rows] for name, col in self.columns.items()})
+
+    def price(
+        self,
+        keys: list[str],
+        prices: Mapping[str, float],
+        fallback_keys: list[str] | None = None,
+        stable_fallback: float = 1.0,
+    ) -> "VaultTable":
+        """Fill tvl_usd from per-row price keys, trying the row's fallback key when its own key is unpriced.
+        Still unpriced stablecoin rows get stable_fallback, still unpriced crypto rows are dropped.
+        """
+
+        def lookup(keys: list[str]) -> npt.NDArray[np.float64]:
+            # One dict lookup per distinct key, then a gather back to rows
+            unique, inverse = np.unique(np.array(keys, dtype=str), return_inverse=True)
+            return np.array([prices.get(key, np.nan) for key in unique], dtype=np.float64)[inverse]
+
+        unit_prices = lookup(keys)
+        if fallback_keys is not None:
+            unit_prices = np.where(np.isnan(unit_prices), lookup(fallback_keys), unit_prices)
+
+        unpriced = np.isnan(unit_prices)
+        unit_prices[unpriced] = stable_fallback
+        keep = ~(unpriced & self.columns["crypto"])
+        table = self.take(keep)
+        table.columns["tvl_usd"] = table.columns["amount"] * unit_prices[keep]
+        return table
+
+    def name_contains(self, *substrings: str) -> npt.NDArray[np.bool_]:
+        """Mask of rows whose name contains any of substrings."""
+        mask = np.zeros(len(self), dtype=bool)
+        for substring in substrings:
+            mask |= np.strings.find(self.columns["name"], substring) >= 0
+        return mask
+
+    def top(self, metric: str, k: int, mask: npt.NDArray[np.bool_] | None = None) -> npt.NDArray[np.intp]:
+        """Indices of the k rows with the highest metric, highest first; ties keep scan order."""
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(len(self))
+        values = self.columns[metric][rows]
+        if k <= 0 or not len(rows):
+            return rows[:0]
+        if k < len(rows):
+            # Partial selection: only rows tied with or above the k-th largest value get sorted
+            kth = np.partition(values, len(values) - k)[len(values) - k]
+            keep = values >= kth
+            rows, values = rows[keep], values[keep]
+        return rows[np.argsort(-values, kind="stable")[:k]]
+
+    def weighted_apr_by(self, column: str) -> dict[Any, float]:
+        """TVL-weighted APR for each distinct value of column."""
+        groups, codes = np.unique(self.columns[column], return_inverse=True)
+        tvl = np.bincount(codes, weights=self.columns["tvl_usd"], minlength=len(groups))
+        weighted = np.bincount(codes, weights=self.columns["apr"] * self.columns["tvl_usd"], minlength=len(groups))
+        return {group.item(): float(w / t) for group, w, t in zip(groups, weighted, tvl) if t > 0}
+
+    def rows(self, indices: npt.NDArray[np.intp], fields: Iterable[str]) -> list[dict[str, Any]]:
+        """Plain dicts of the given fields for the rows at indices, in that order."""
+        fields = list(fields)
+        return [{field: self.columns[field][i].item() for field in fields} for i in indices]
@@ -1,25 +1,54 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
+from web3 import Web3
+
+import http_cache
+import store
+import tracing
+from calls import (
+    ASSET,
+    DECIMALS,
+    GET_STRATEGY_APR,
+    LATEST_ROUND_DATA,
+    NAME,
+    TOTAL_ASSETS,
+    VAULT_INFO,
+    Result,
+    address_word,
+    decode_address,
+    decode_int,
+    decode_string,
+    decode_uint,
+    word,
+)
+from registry import discover_vaults
+from rpc import CachingProvider
 from utils import (
     APR_ORACLE_ADDRESS,
+    CHAIN_TIMEOUT,
     CHAINS,
-    REGISTRY_ADDRESSES,
-    fetch_btc_price,
-    fetch_eth_price,
+    ETH_PRICE_KEY,
+    SCAN_WORKERS,
+    block_time,
+    env_list,
     fetch_json,
-    fetch_sky_price,
-    fetch_yyb_price,
+    fetch_prices,
     get_web3,
-    load_abi,
     multicall,
 )
+from vault_table import VaultTable
 
-KATANA_APR_API = "https://katana-apr-service.vercel.app/api/vaults"
+KATANA_APR_API = os.getenv("KATANA_APR_API", "https://katana-apr-service.vercel.app/api/vaults")
+http_cache.TTLS[KATANA_APR_API] = 900
 
 # Vault types
 MULTI_STRATEGY_TYPE = 1
 
-# Crypto tokens by type (everything else is USD, worth $1)
+# Crypto tokens by type (everything else is listed as a stablecoin vault)
 WETH_ADDRESSES = {
     "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",  # mainnet
     "0x4200000000000000000000000000000000000006",  # base
@@ -40,6 +69,39 @@ YYB = "0x22222222aea0076fca927a3f44dc0b4fdf9479d6"
 
 CRYPTO_TOKENS = WETH_ADDRESSES | WBTC_ADDRESSES | {SKY, YYB}
 
+# Price of each crypto token's class, for assets llama can't price by chain:address (e.g. on Katana)
+CLASS_PRICE_KEYS = {
+    **dict.fromkeys(WETH_ADDRESSES, ETH_PRICE_KEY),
+    **dict.fromkeys(WBTC_ADDRESSES, "coingecko:bitcoin"),
+    SKY: f"ethereum:{SKY}",
+    YYB: f"ethereum:{YYB}",
+}
+
+# On-chain USD price feeds (Chainlink AggregatorV3) by chain and asset, read in the chain's vault scan multicall.
+# PRICE_FEEDS_<CHAIN> ("asset=feed,...", empty for none) replaces a chain's defaults. Assets without a feed, or
+# whose feed reverts or hasn't updated within PRICE_FEED_MAX_AGE seconds, are priced by coins.llama.fi.
+DEFAULT_PRICE_FEEDS = {
+    "mainnet": {
+        "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2": "0x5f4eC3Df9cbd43714FE2740f5E3616155c5b8419",  # WETH: ETH/USD
+        "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599": "0xF4030086522a5bEEa4988F8cA5B36dbC97BeE88c",  # WBTC: BTC/USD
+        "0xcbb7c0000ab88b473b1f5afd9ef808440eed33bf": "0xF4030086522a5bEEa4988F8cA5B36dbC97BeE88c",  # cbBTC: BTC/USD
+    },
+    "arbitrum": {
+        "0x82af49447d8a07e3bd95bd0d56f35241523fbab1": "0x639Fe6ab55C921f74e7fac1ee960C0B6293ba612",  # WETH: ETH/USD
+    },
+    "base": {
+        "0x4200000000000000000000000000000000000006": "0x71041dddad3595F9CEd3DcCFBe3D1F4b0a16Bb70",  # WETH: ETH/USD
+    },
+}
+PRICE_FEED_MAX_AGE = float(os.getenv("PRICE_FEED_MAX_AGE", "86400"))
+
+# Vaults are listed if their name contains one of LISTED_NAMES and none of UNLISTED_NAMES
+LISTED_NAMES = ("yVault", "BOLD", "USDaf")
+UNLISTED_NAMES = ("Liquid Locker Compounder",)
+
+TOP_N = 5
+OUTPUT_FIELDS = ("name", "chain", "chain_id", "address", "apr", "tvl_usd")
+
 # Vaults to exclude
 EXCLUDED_VAULTS = {
     "0x252b965400862d94BDa35FeCF7Ee0f204a53Cc36",
@@ -63,164 +125,240 @@ def fetch_katana_aprs() -> dict[str, float]:
         return {}
 
 
-def get_data() -> dict[str, Any]:
-    """Fetch top V3 Multi Strategy vaults from on-chain registries."""
-    usd_vaults: list[dict[str, Any]] = []
-    crypto_vaults: list[dict[str, Any]] = []
-
-    eth_price = fetch_eth_price()
-    btc_price = fetch_btc_price()
-    sky_price = fetch_sky_price()
-    yyb_price = fetch_yyb_price()
-    katana_aprs = fetch_katana_aprs()
-
-    registry_abi = load_abi("registry")
-    vault_abi = load_abi("vault")
-    apr_oracle_abi = load_abi("apr_oracle")
-
-    for chain_name, chain_info in CHAINS.items():
-        try:
-            w3 = get_web3(chain_name)
-        except ValueError:
+def price_feeds(chain_name: str) -> dict[str, str]:
+    """Asset -> price feed address for chain_name: PRICE_FEEDS_<CHAIN> if set, else the defaults."""
+    if os.getenv(f"PRICE_FEEDS_{chain_name.upper()}") is None:
+        return DEFAULT_PRICE_FEEDS.get(chain_name, {})
+    feeds = {}
+    for item in env_list(f"PRICE_FEEDS_{chain_name.upper()}"):
+        asset, _, feed = (part.strip() for part in item.partition("="))
+        if not (Web3.is_address(asset) and Web3.is_address(feed)):
+            print(f"Ignoring PRICE_FEEDS_{chain_name.upper()} entry {item!r}: expected asset=feed addresses")
             continue
-
-        # Query all registries and collect vault addresses
-        vault_addresses = []
-        registry_for_vault = {}  # Track which registry each vault came from
-
-        for registry_addr in REGISTRY_ADDRESSES:
-            registry = w3.eth.contract(
-                address=w3.to_checksum_address(registry_addr),
-                abi=registry_abi,
-            )
-
-            try:
-                all_vaults = registry.functions.getAllEndorsedVaults().call()
-                for sublist in all_vaults:
-                    for addr in sublist:
-                        if addr not in registry_for_vault:
-                            vault_addresses.append(addr)
-                            registry_for_vault[addr] = registry_addr
-            except Exception:
-                continue
-
-        if not vault_addresses:
+        feeds[asset.lower()] = feed
+    return feeds
+
+
+def decode_feed_price(round_data: Result, decimals: int, now: float) -> float | None:
+    """USD price from a feed's latestRoundData result, None if unusable or stale at now."""
+    success, data = round_data
+    if not success or len(data) < 160:
+        return None
+    # latestRoundData: (roundId, answer, startedAt, updatedAt, answeredInRound)
+    answer = decode_int(data[32:])
+    updated_at = decode_uint(data[96:])
+    if answer <= 0 or now - updated_at > PRICE_FEED_MAX_AGE:
+        return None
+    return answer * 10.0**-decimals
+
+
+def scan_chain(
+    chain_name: str,
+    chain_info: dict[str, Any],
+    katana_aprs: dict[str, float],
+) -> tuple[list[dict[str, Any]], dict[str, float]]:
+    """Scan one chain's registries and return its Multi Strategy vaults, tagged with asset and amount, and the
+    USD prices (by asset) read from the chain's price feeds.
+    """
+    try:
+        w3 = get_web3(chain_name)
+    except ValueError:
+        return [], {}
+
+    # Endorsed vaults from the local registry index, updated with this week's registry events
+    endorsed = discover_vaults(w3, chain_name)
+
+    vault_addresses = []
+    registry_for_vault = {}  # Track which registry each vault came from
+    for addr, registry_addr in endorsed:
+        if addr not in registry_for_vault and addr not in EXCLUDED_VAULTS:
+            vault_addresses.append(addr)
+            registry_for_vault[addr] = registry_addr
+
+    if not vault_addresses:
+        return [], {}
+
+    # Round trip 2: immutable fields (vaultInfo, name, asset, decimals) only for vaults not seen before,
+    # plus totalAssets and APR (except Katana) for every vault that may be Multi Strategy. Runs pinned to a snapshot
+    # read them for every vault, so the calls they make don't depend on what earlier runs cached.
+    pinned = isinstance(w3.provider, CachingProvider) and w3.provider.block is not None
+    known = {} if pinned else store.vault_meta(chain_name)
+    is_katana = chain_name == "katana"
+    calls: list[tuple[str, bytes]] = []
+    slots = {}  # vault -> index of its first call
+    for addr in vault_addresses:
+        meta = known.get(addr)
+        if meta is not None and meta["vault_type"] != MULTI_STRATEGY_TYPE:
             continue
-
-        vault_contract = w3.eth.contract(abi=vault_abi)
-        apr_oracle = w3.eth.contract(
-            address=w3.to_checksum_address(APR_ORACLE_ADDRESS),
-            abi=apr_oracle_abi,
-        )
-
-        # First multicall: get vaultInfo to filter for Multi Strategy vaults
-        info_calls = []
-        for addr in vault_addresses:
-            checksum_addr = w3.to_checksum_address(addr)
-            reg_addr = registry_for_vault[addr]
-            registry = w3.eth.contract(address=w3.to_checksum_address(reg_addr), abi=registry_abi)
-            info_calls.append((reg_addr, registry.encode_abi("vaultInfo", args=[checksum_addr])))
-
-        info_results = multicall(w3, info_calls)
-
-        # Filter for Multi Strategy vaults only
-        multi_strategy_vaults = []
-        for i, addr in enumerate(vault_addresses):
-            if addr in EXCLUDED_VAULTS:
+        slots[addr] = len(calls)
+        if meta is None:
+            calls.append((registry_for_vault[addr], VAULT_INFO + address_word(addr)))
+            calls.append((addr, NAME))
+            calls.append((addr, ASSET))
+            calls.append((addr, DECIMALS))
+        calls.append((addr, TOTAL_ASSETS))
+        if not is_katana:
+            calls.append((APR_ORACLE_ADDRESS, GET_STRATEGY_APR + address_word(addr) + word(0)))
+
+    # Asset prices ride along in the same multicall, saving the HTTP price lookup for these assets. Assets sharing a
+    # feed read it once, and a feed's decimals only until they are cached (except on pinned runs, as above).
+    feeds = price_feeds(chain_name)
+    known_decimals = {} if pinned else store.feed_decimals(chain_name)
+    feed_slots = {}  # feed -> index of its latestRoundData result, followed by decimals() unless cached
+    for feed in dict.fromkeys(feeds.values()):
+        feed_slots[feed] = len(calls)
+        calls.append((feed, LATEST_ROUND_DATA))
+        if feed not in known_decimals:
+            calls.append((feed, DECIMALS))
+
+    results = multicall(w3, calls) if calls else []
+
+    # Staleness is judged at the block read, so a snapshot prices the same way on every run
+    now = block_time(w3) if feed_slots else 0
+    feed_prices = {}
+    new_decimals = {}
+    for feed, slot in feed_slots.items():
+        decimals = known_decimals.get(feed)
+        if decimals is None:
+            decimals_success, decimals_data = results[slot + 1]
+            if not decimals_success:
                 continue
-
-            success, data = info_results[i]
-            if not success:
+            decimals = new_decimals[feed] = decode_uint(decimals_data)
+        price = decode_feed_price(results[slot], decimals, now)
+        if price is not None:
+            feed_prices[feed] = price
+    if new_decimals:
+        store.put_feed_decimals(chain_name, new_decimals)
+    prices = {asset: feed_prices[feed] for asset, feed in feeds.items() if feed in feed_prices}
+
+    new_meta = []
+    vaults = []
+    for addr, idx in slots.items():
+        meta = known.get(addr)
+        if meta is None:
+            info_success, info_data = results[idx]
+            name_success, name_data = results[idx + 1]
+            asset_success, asset_data = results[idx + 2]
+            decimals_success, decimals_data = results[idx + 3]
+            idx += 4
+            if not info_success:
                 continue
 
-            decoded = w3.codec.decode(["address", "uint96", "uint64", "uint128", "uint64", "string"], data)
-            vault_type = decoded[2]
-
-            if vault_type == MULTI_STRATEGY_TYPE:
-                multi_strategy_vaults.append(addr)
-
-        if not multi_strategy_vaults:
+            # vaultInfo: (asset, releaseVersion, vaultType, deploymentTimestamp, index, tag)
+            meta = {
+                "address": addr,
+                "vault_type": decode_uint(info_data[64:]),
+                "name": None,
+                "asset": None,
+                "decimals": None,
+            }
+            if all([name_success, asset_success, decimals_success]):
+                meta["name"] = decode_string(name_data)
+                meta["asset"] = decode_address(asset_data)
+                meta["decimals"] = decode_uint(decimals_data)
+            # Retry Multi Strategy vaults whose fields failed to read on the next run
+            if meta["vault_type"] != MULTI_STRATEGY_TYPE or meta["name"] is not None:
+                new_meta.append(meta)
+
+        if meta["vault_type"] != MULTI_STRATEGY_TYPE or meta["name"] is None:
             continue
 
-        # Second multicall: get name, asset, totalAssets, decimals, and APR (except Katana)
-        is_katana = chain_name == "katana"
-        calls = []
-        for addr in multi_strategy_vaults:
-            checksum_addr = w3.to_checksum_address(addr)
-            calls.append((addr, vault_contract.encode_abi("name")))
-            calls.append((addr, vault_contract.encode_abi("asset")))
-            calls.append((addr, vault_contract.encode_abi("totalAssets")))
-            calls.append((addr, vault_contract.encode_abi("decimals")))
-            if not is_katana:
-                calls.append((APR_ORACLE_ADDRESS, apr_oracle.encode_abi("getStrategyApr", args=[checksum_addr, 0])))
-
-        results = multicall(w3, calls)
-        calls_per_vault = 4 if is_katana else 5
-
-        for i, addr in enumerate(multi_strategy_vaults):
-            base_idx = i * calls_per_vault
-            name_success, name_data = results[base_idx]
-            asset_success, asset_data = results[base_idx + 1]
-            total_assets_success, total_assets_data = results[base_idx + 2]
-            decimals_success, decimals_data = results[base_idx + 3]
-
-            if not all([name_success, asset_success, total_assets_success, decimals_success]):
-                continue
-
-            name = w3.codec.decode(["string"], name_data)[0]
-
-            # Skip Liquid Locker Compounder vaults
-            if "Liquid Locker Compounder" in name:
-                continue
-
-            # Only include vaults with yVault, BOLD, or USDaf in name
-            if not any(x in name for x in ("yVault", "BOLD", "USDaf")):
-                continue
+        total_assets_success, total_assets_data = results[idx]
+        if not total_assets_success:
+            continue
 
-            asset = w3.codec.decode(["address"], asset_data)[0].lower()
-            total_assets = w3.codec.decode(["uint256"], total_assets_data)[0]
-            decimals = w3.codec.decode(["uint8"], decimals_data)[0]
+        total_assets = decode_uint(total_assets_data)
 
-            # Get APR from Katana API or APR oracle
-            if is_katana:
-                apr_pct = katana_aprs.get(addr.lower(), 0.0)
-            else:
-                apr_success, apr_data = results[base_idx + 4]
-                apr_pct = 0.0
-                if apr_success:
-                    apr_raw = w3.codec.decode(["uint256"], apr_data)[0]
-                    apr_pct = (apr_raw / 1e18) * 100
-
-            # Calculate TVL
-            amount = total_assets / (10**decimals)
-            if asset in WETH_ADDRESSES:
-                tvl_usd = amount * eth_price
-            elif asset in WBTC_ADDRESSES:
-                tvl_usd = amount * btc_price
-            elif asset == SKY:
-                tvl_usd = amount * sky_price
-            elif asset == YYB:
-                tvl_usd = amount * yyb_price
-            else:
-                # Stablecoins assume $1
-                tvl_usd = amount
+        # Get APR from Katana API or APR oracle
+        if is_katana:
+            apr_pct = katana_aprs.get(addr.lower(), 0.0)
+        else:
+            apr_success, apr_data = results[idx + 1]
+            apr_pct = 0.0
+            if apr_success:
+                apr_pct = (decode_uint(apr_data) / 1e18) * 100
 
-            chain_id = chain_info["chain_id"]
-            vault = {
-                "name": name,
+        vaults.append(
+            {
+                "name": meta["name"],
                 "chain": chain_name,
-                "chain_id": chain_id,
+                "chain_id": chain_info["chain_id"],
                 "address": addr,
                 "apr": apr_pct,
-                "tvl_usd": tvl_usd,
+                "asset": meta["asset"],
+                "amount": total_assets / (10 ** meta["decimals"]),
             }
+        )
 
-            if asset in CRYPTO_TOKENS:
-                crypto_vaults.append(vault)
-            else:
-                usd_vaults.append(vault)
+    store.put_vault_meta(chain_name, new_meta)
+    return vaults, prices
 
-    usd_vaults.sort(key=lambda x: x["apr"], reverse=True)
-    crypto_vaults.sort(key=lambda x: x["apr"], reverse=True)
 
-    return {"top_usd": usd_vaults[:5], "top_crypto": crypto_vaults[:5]}
+def get_data() -> dict[str, Any]:
+    """Fetch top V3 Multi Strategy vaults from on-chain registries, scanning chains concurrently."""
+    katana_aprs = fetch_katana_aprs()
+
+    # One worker per chain by default, so a slow RPC only delays its own chain.
+    # Results are collected in CHAINS order to keep the ranking identical to a serial scan.
+    # Each chain gets CHAIN_TIMEOUT from when its own scan starts, not from when it was queued behind other chains
+    started = {chain_name: threading.Event() for chain_name in CHAINS}
+    start_times: dict[str, float] = {}
+
+    def timed_scan(chain_name: str, chain_info: dict[str, Any]) -> tuple[list[dict[str, Any]], dict[str, float]]:
+        start_times[chain_name] = time.monotonic()
+        started[chain_name].set()
+        return scan_chain(chain_name, chain_info, katana_aprs)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS))
+    futures = {
+        chain_name: pool.submit(tracing.bind(timed_scan), chain_name, chain_info)
+        for chain_name, chain_info in CHAINS.items()
+    }
+
+    scanned: list[dict[str, Any]] = []
+    prices: dict[str, float] = {}  # llama coin key -> USD price, from on-chain feeds first
+    for chain_name, future in futures.items():
+        # Chains before this one are done or timed out; a scan still queued waits on timed out ones
+        if not started[chain_name].wait(CHAIN_TIMEOUT):
+            print(f"Skipping {chain_name}: vault scan didn't start within {CHAIN_TIMEOUT:g}s")
+            continue
+        try:
+            remaining = start_times[chain_name] + CHAIN_TIMEOUT - time.monotonic()
+            chain_vaults, chain_prices = future.result(timeout=max(0.0, remaining))
+        except TimeoutError as e:
+            if future.done():
+                print(f"Skipping {chain_name}: vault scan failed ({e!r})")
+            else:
+                print(f"Skipping {chain_name}: vault scan timed out after {CHAIN_TIMEOUT:g}s")
+            continue
+        except Exception as e:
+            print(f"Skipping {chain_name}: vault scan failed ({e})")
+            continue
+        scanned.extend(chain_vaults)
+        prices.update({f"{CHAINS[chain_name]['llama']}:{asset}": price for asset, price in chain_prices.items()})
+
+    # Don't wait on chains that timed out
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    table = VaultTable.from_rows(scanned, CRYPTO_TOKENS)
+
+    # Only yVault, BOLD and USDaf vaults, without Liquid Locker Compounders
+    table = table.take(table.name_contains(*LISTED_NAMES) & ~table.name_contains(*UNLISTED_NAMES))
+
+    # Price the vault assets without an on-chain feed across all chains in one batched lookup
+    # (and the class price of those assets, in case llama doesn't know them)
+    keys = [f"{CHAINS[chain]['llama']}:{asset}" for chain, asset in zip(table["chain"], table["asset"])]
+    fallback_keys = [CLASS_PRICE_KEYS.get(asset, key) for key, asset in zip(keys, table["asset"])]
+    unpriced = {key for key in keys if key not in prices}
+    unpriced |= {fallback for key, fallback in zip(keys, fallback_keys) if key in unpriced and fallback not in prices}
+    if unpriced:
+        prices.update(fetch_prices(unpriced))
+    table = table.price(keys, prices, fallback_keys)
+
+    crypto = table["crypto"]
+    return {
+        "top_usd": table.rows(table.top("apr", TOP_N, ~crypto), OUTPUT_FIELDS),
+        "top_crypto": table.rows(table.top("apr", TOP_N, crypto), OUTPUT_FIELDS),
+        "top_tvl": table.rows(table.top("tvl_usd", TOP_N), OUTPUT_FIELDS),
+        "apr_by_chain": table.weighted_apr_by("chain"),
+    }
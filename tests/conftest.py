@@ -0,0 +1,21 @@
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+import store
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    """An empty store in tmp_path, with a fresh connection."""
+    monkeypatch.setattr(store, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(store, "DB_PATH", tmp_path / "cache.db")
+    monkeypatch.setattr(store, "HISTORY_PATH", tmp_path / "history.db")
+    monkeypatch.setattr(store, "_local", threading.local())
+    monkeypatch.setattr(store, "_migrated", set())
+    yield tmp_path
+    conn = getattr(store._local, "conn", None)
+    if conn is not None:
+        conn.close()
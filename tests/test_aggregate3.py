@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+from typing import Any, cast
+
+import pytest
+import requests
+from eth_abi.abi import decode, encode
+from web3 import Web3
+from web3.exceptions import ContractLogicError, Web3RPCError
+
+from calls import AGGREGATE3
+from rpc import Throttled
+from utils import aggregate3, rejected
+
+TARGET = "0x" + "01" * 20
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+class FakeEth:
+    """Answers aggregate3 with each call's calldata, raising error for batches over max_calls."""
+
+    def __init__(self, max_calls: int, error: Exception) -> None:
+        self.max_calls = max_calls
+        self.error = error
+        self.sizes: list[int] = []
+
+    def call(self, tx: dict[str, Any], block: Any) -> bytes:
+        (calls,) = decode(["(address,bool,bytes)[]"], tx["data"][len(AGGREGATE3) :])
+        self.sizes.append(len(calls))
+        if len(calls) > self.max_calls:
+            raise self.error
+        return encode(["(bool,bytes)[]"], [[(True, data) for _, _, data in calls]])
+
+
+def fake_w3(eth: FakeEth) -> Web3:
+    return cast(Web3, SimpleNamespace(eth=eth))
+
+
+@pytest.mark.parametrize(
+    "error",
+    [http_error(413), http_error(400), Web3RPCError("out of gas"), ContractLogicError("execution reverted")],
+)
+def test_rejections(error: Exception) -> None:
+    assert rejected(error)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        http_error(429),
+        http_error(503),
+        Throttled("throttled", 1.0, requests.Response()),
+        requests.ConnectionError("refused"),
+        ValueError("aggregate3 result too short"),
+        KeyError("result"),
+    ],
+)
+def test_not_rejections(error: Exception) -> None:
+    assert not rejected(error)
+
+
+def test_bisects_rejected_batches() -> None:
+    eth = FakeEth(2, http_error(413))
+    calls = [(TARGET, bytes([i])) for i in range(5)]
+    assert [bytes(data) for _, data in aggregate3(fake_w3(eth), calls)] == [bytes([i]) for i in range(5)]
+    assert eth.sizes == [5, 2, 3, 1, 2]
+
+
+def test_raises_other_errors_unchanged() -> None:
+    error = ValueError("bad result")
+    eth = FakeEth(0, error)
+    with pytest.raises(ValueError) as raised:
+        aggregate3(fake_w3(eth), [(TARGET, b"\x01"), (TARGET, b"\x02")])
+    assert raised.value is error
+    assert eth.sizes == [2]
@@ -0,0 +1,72 @@
+import pytest
+from eth_abi.abi import decode, encode
+
+from calls import (
+    AGGREGATE3,
+    DECIMALS,
+    address_word,
+    decode_address,
+    decode_aggregate3,
+    decode_int,
+    decode_string,
+    decode_uint,
+    encode_aggregate3,
+    word,
+)
+
+VAULT = "0x182863131f9a4630ff9e27830d945b1413e347e8"
+MULTICALL3 = "0xca11bde05977b3631167028862be2a173976ca11"
+
+
+def test_selector() -> None:
+    assert DECIMALS.hex() == "313ce567"
+    assert AGGREGATE3.hex() == "82ad56cb"
+
+
+def test_words_match_abi_encoding() -> None:
+    assert word(7) == encode(["uint256"], [7])
+    assert word(-1) == encode(["int256"], [-1])
+    assert address_word(VAULT) == encode(["address"], [VAULT])
+
+
+def test_encode_aggregate3_matches_abi_encoding() -> None:
+    calls = [(VAULT, DECIMALS), (MULTICALL3, b"\x01" * 37), (VAULT, b"")]
+    expected = encode(["(address,bool,bytes)[]"], [[(target, True, data) for target, data in calls]])
+    assert encode_aggregate3(calls) == AGGREGATE3 + expected
+
+
+def test_encode_aggregate3_empty() -> None:
+    assert encode_aggregate3([]) == AGGREGATE3 + encode(["(address,bool,bytes)[]"], [[]])
+
+
+def test_decode_aggregate3_round_trips() -> None:
+    results = [(True, encode(["uint256"], [18])), (False, b""), (True, b"\xff" * 33)]
+    decoded = decode_aggregate3(encode(["(bool,bytes)[]"], [results]))
+    assert [(success, bytes(data)) for success, data in decoded] == results
+    assert all(isinstance(data, memoryview) for _, data in decoded)
+
+
+def test_decode_words() -> None:
+    assert decode_uint(encode(["uint8"], [18])) == 18
+    assert decode_int(encode(["int256"], [-42])) == -42
+    assert decode_address(encode(["address"], [VAULT])) == VAULT
+    with pytest.raises(ValueError):
+        decode_uint(b"\x00" * 31)
+
+
+def test_decode_string() -> None:
+    data = encode(["string"], ["USDC-1 yVault"])
+    assert decode_string(data) == "USDC-1 yVault"
+    assert decode_string(memoryview(data)) == "USDC-1 yVault"
+    # The head may sit after other fields, e.g. the third field of a tuple
+    assert decode_string(encode(["uint256", "uint256", "string"], [1, 2, "yCRV"]), 64) == "yCRV"
+    with pytest.raises(ValueError):
+        decode_string(data[:-32])
+
+
+def test_decode_aggregate3_matches_abi_decoding() -> None:
+    results = [(True, b"\x00" * 64), (True, b"abc")]
+    data = encode(["(bool,bytes)[]"], [results])
+    assert [(s, bytes(d)) for s, d in decode_aggregate3(data)] == [
+        tuple(r) for r in decode(["(bool,bytes)[]"], data)[0]
+    ]
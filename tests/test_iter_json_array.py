@@ -0,0 +1,42 @@
+import io
+import json
+from typing import Any
+
+import pytest
+
+from utils import iter_json_array
+
+
+def parse(text: str, chunk_size: int) -> list[Any]:
+    return list(iter_json_array(io.BytesIO(text.encode()), chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[]",
+        " [ ] ",
+        "[1]",
+        '[1, -3e+10, 0.5, "a,b]", null, true]',
+        '[{"name": "Yearn", "tvl": 1.5, "chains": ["Ethereum", "Base"]}, {"tvl": null}]',
+        '\n[\n  {"emoji": "é☃"},\n  [[], {}]\n]\n',
+    ],
+)
+def test_matches_json_loads(text: str, chunk_size: int) -> None:
+    assert parse(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64 * 1024])
+@pytest.mark.parametrize("text", ["[1 2]", "[,1]", "[1,,2]", "[1,]", "[1", "[1,", "", "{}", "1", '["a" "b"]'])
+def test_rejects_malformed(text: str, chunk_size: int) -> None:
+    with pytest.raises(ValueError):
+        parse(text, chunk_size)
+
+
+def test_streams() -> None:
+    f = io.BytesIO(b"[" + b",".join(b'{"i": %d}' % i for i in range(1000)) + b"]")
+    items = iter_json_array(f, 64)
+    assert next(items) == {"i": 0}
+    assert f.tell() < 1000
+    assert sum(1 for _ in items) == 999
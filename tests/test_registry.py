@@ -0,0 +1,212 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, cast
+
+import pytest
+from web3 import Web3
+
+import registry
+import store
+from utils import LOG_CONFIRMATIONS
+
+CHAIN = "mainnet"
+REGISTRY_A = Web3.to_checksum_address("0x" + "aa" * 20)
+REGISTRY_B = Web3.to_checksum_address("0x" + "bb" * 20)
+VAULT_1 = Web3.to_checksum_address("0x" + "01" * 20)
+VAULT_2 = Web3.to_checksum_address("0x" + "02" * 20)
+VAULT_3 = Web3.to_checksum_address("0x" + "03" * 20)
+ENDORSED, REMOVED = "0x" + "11" * 32, "0x" + "22" * 32
+
+
+def meta(vault: str) -> dict[str, Any]:
+    return {"address": vault, "vault_type": 1, "name": "yVault", "asset": vault, "decimals": 18}
+
+
+def test_update_registry_index_adds_and_removes(data_dir: Path) -> None:
+    store.update_registry_index(
+        CHAIN,
+        [(True, VAULT_1, REGISTRY_A, 10), (True, VAULT_2, REGISTRY_A, 12), (True, VAULT_1, REGISTRY_B, 11)],
+        {REGISTRY_A: 20, REGISTRY_B: 20},
+    )
+    assert store.endorsed_vaults(CHAIN) == [(VAULT_1, REGISTRY_A), (VAULT_1, REGISTRY_B), (VAULT_2, REGISTRY_A)]
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: 20, REGISTRY_B: 20}
+
+    # A removal only drops the vault from the registry that emitted it
+    store.update_registry_index(CHAIN, [(False, VAULT_1, REGISTRY_A, 25)], {REGISTRY_A: 30})
+    assert store.endorsed_vaults(CHAIN) == [(VAULT_1, REGISTRY_B), (VAULT_2, REGISTRY_A)]
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: 30, REGISTRY_B: 20}
+    assert store.endorsed_vaults("base") == []
+
+
+def test_update_registry_index_replaces_enumerated_registries(data_dir: Path) -> None:
+    store.update_registry_index(CHAIN, [(True, VAULT_1, REGISTRY_A, 10), (True, VAULT_2, REGISTRY_B, 10)], {})
+    store.update_registry_index(CHAIN, [(True, VAULT_3, REGISTRY_A, 40)], {REGISTRY_A: 40}, [REGISTRY_A])
+    assert store.endorsed_vaults(CHAIN) == [(VAULT_2, REGISTRY_B), (VAULT_3, REGISTRY_A)]
+
+
+def test_update_registry_index_drops_metadata_of_new_endorsements(data_dir: Path) -> None:
+    store.update_registry_index(CHAIN, [(True, VAULT_1, REGISTRY_A, 10)], {REGISTRY_A: 10})
+    store.put_vault_meta(CHAIN, [meta(VAULT_1), meta(VAULT_2)])
+
+    # Re-applying an endorsement already indexed keeps the cached metadata
+    store.update_registry_index(CHAIN, [(True, VAULT_1, REGISTRY_A, 10)], {REGISTRY_A: 20}, [REGISTRY_A])
+    assert set(store.vault_meta(CHAIN)) == {VAULT_1, VAULT_2}
+
+    # A vault removed and endorsed again is read afresh, as is one endorsed for the first time
+    store.update_registry_index(
+        CHAIN,
+        [(False, VAULT_1, REGISTRY_A, 21), (True, VAULT_1, REGISTRY_A, 22), (True, VAULT_2, REGISTRY_A, 23)],
+        {REGISTRY_A: 30},
+    )
+    assert store.vault_meta(CHAIN) == {}
+
+
+def test_update_registry_index_is_atomic(data_dir: Path) -> None:
+    store.update_registry_index(CHAIN, [(True, VAULT_1, REGISTRY_A, 10)], {REGISTRY_A: 10})
+    with pytest.raises(Exception):
+        store.update_registry_index(
+            CHAIN, [(False, VAULT_1, REGISTRY_A, 11), (True, VAULT_2, REGISTRY_A, 11)], {REGISTRY_A: cast(int, None)}
+        )
+    assert store.endorsed_vaults(CHAIN) == [(VAULT_1, REGISTRY_A)]
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: 10}
+
+
+class FakeChain:
+    """Stands in for the node: registry contents, logs and the calls discover_vaults made."""
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch, head: int) -> None:
+        self.head = head
+        self.endorsed: dict[str, list[str]] = {REGISTRY_A: [], REGISTRY_B: []}
+        self.logs: list[dict[str, Any]] = []
+        self.logs_fail = False
+        self.broken: set[str] = set()
+        self.enumerated: list[tuple[list[str], Any]] = []
+        self.log_ranges: list[tuple[list[str], int, int]] = []
+        monkeypatch.setattr(registry, "REGISTRY_ADDRESSES", [REGISTRY_A, REGISTRY_B])
+        monkeypatch.setattr(registry, "enumerate_registries", self.enumerate_registries)
+        monkeypatch.setattr(registry, "fetch_logs", self.fetch_logs)
+        monkeypatch.setattr(registry, "event_topics", lambda w3: (ENDORSED, REMOVED))
+        self.w3 = cast(
+            Web3,
+            SimpleNamespace(
+                provider=None,
+                eth=self,
+                to_checksum_address=Web3.to_checksum_address,
+            ),
+        )
+
+    @property
+    def block_number(self) -> int:
+        return self.head
+
+    @property
+    def safe(self) -> int:
+        return self.head - LOG_CONFIRMATIONS
+
+    def enumerate_registries(self, w3: Web3, registries: list[str], block: Any) -> dict[str, list[str]]:
+        if registries:
+            self.enumerated.append((list(registries), block))
+        return {r: list(self.endorsed[r]) for r in registries if r not in self.broken}
+
+    def fetch_logs(self, w3: Web3, registries: list[str], from_block: int, to_block: int) -> list[Any]:
+        self.log_ranges.append((list(registries), from_block, to_block))
+        if self.logs_fail:
+            raise ValueError("eth_getLogs is not supported")
+        return [
+            log
+            for log in self.logs
+            if Web3.to_checksum_address(log["address"]) in registries and from_block <= log["blockNumber"] <= to_block
+        ]
+
+    def emit(self, endorsed: bool, vault: str, registry: str, block: int) -> None:
+        topic = bytes.fromhex((ENDORSED if endorsed else REMOVED)[2:])
+        self.logs.append(
+            {
+                "address": registry.lower(),
+                "blockNumber": block,
+                "logIndex": len(self.logs),
+                "topics": [topic, bytes(12) + bytes.fromhex(vault[2:])],
+            }
+        )
+        vaults = self.endorsed[registry]
+        if endorsed:
+            vaults.append(vault)
+        else:
+            vaults.remove(vault)
+
+
+@pytest.fixture
+def chain(data_dir: Path, monkeypatch: pytest.MonkeyPatch) -> FakeChain:
+    return FakeChain(monkeypatch, head=1_000)
+
+
+def test_discover_vaults_enumerates_then_follows_logs(chain: FakeChain) -> None:
+    chain.emit(True, VAULT_1, REGISTRY_A, 100)
+    chain.emit(True, VAULT_2, REGISTRY_B, 100)
+
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_1, REGISTRY_A), (VAULT_2, REGISTRY_B)]
+    assert chain.enumerated == [([REGISTRY_A, REGISTRY_B], chain.safe)]
+    assert chain.log_ranges == []
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: chain.safe, REGISTRY_B: chain.safe}
+
+    first_safe = chain.safe
+    chain.head += 50
+    chain.emit(True, VAULT_3, REGISTRY_A, chain.safe - 10)
+    chain.emit(False, VAULT_1, REGISTRY_A, chain.safe)
+    # Not confirmed yet: picked up on a later run
+    chain.emit(True, VAULT_1, REGISTRY_B, chain.safe + 1)
+
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_2, REGISTRY_B), (VAULT_3, REGISTRY_A)]
+    assert chain.log_ranges == [([REGISTRY_A, REGISTRY_B], first_safe + 1, chain.safe)]
+    assert len(chain.enumerated) == 1
+
+    chain.head += 1
+    assert registry.discover_vaults(chain.w3, CHAIN)[-1] == (VAULT_1, REGISTRY_B)
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: chain.safe, REGISTRY_B: chain.safe}
+
+
+def test_discover_vaults_skips_registries_up_to_date(chain: FakeChain) -> None:
+    registry.discover_vaults(chain.w3, CHAIN)
+    registry.discover_vaults(chain.w3, CHAIN)
+    assert chain.log_ranges == []
+    assert len(chain.enumerated) == 1
+
+
+def test_discover_vaults_enumerates_when_logs_fail(chain: FakeChain) -> None:
+    chain.emit(True, VAULT_1, REGISTRY_A, 100)
+    registry.discover_vaults(chain.w3, CHAIN)
+
+    chain.head += 50
+    chain.emit(False, VAULT_1, REGISTRY_A, chain.safe - 1)
+    chain.emit(True, VAULT_2, REGISTRY_A, chain.safe)
+    chain.logs_fail = True
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_2, REGISTRY_A)]
+    assert chain.enumerated[-1] == ([REGISTRY_A, REGISTRY_B], chain.safe)
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: chain.safe, REGISTRY_B: chain.safe}
+
+
+def test_discover_vaults_retries_failed_registries(chain: FakeChain) -> None:
+    chain.emit(True, VAULT_1, REGISTRY_A, 100)
+    chain.emit(True, VAULT_2, REGISTRY_B, 100)
+    chain.broken.add(REGISTRY_B)
+
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_1, REGISTRY_A)]
+    assert store.registry_cursors(CHAIN) == {REGISTRY_A: chain.safe}
+
+    chain.broken.clear()
+    chain.head += 10
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_1, REGISTRY_A), (VAULT_2, REGISTRY_B)]
+    assert chain.enumerated[-1] == ([REGISTRY_B], chain.safe)
+
+
+def test_discover_vaults_pinned_reads_at_snapshot_block(chain: FakeChain, monkeypatch: pytest.MonkeyPatch) -> None:
+    class Pinned:
+        block = 500
+
+    monkeypatch.setattr(registry, "CachingProvider", Pinned)
+    chain.w3.provider = Pinned()  # type: ignore[assignment]
+    chain.emit(True, VAULT_1, REGISTRY_A, 100)
+
+    assert registry.discover_vaults(chain.w3, CHAIN) == [(VAULT_1, REGISTRY_A)]
+    assert chain.enumerated == [([REGISTRY_A, REGISTRY_B], 500)]
+    assert store.registry_cursors(CHAIN) == {}
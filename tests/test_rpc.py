@@ -0,0 +1,28 @@
+import pytest
+
+from rpc import throttle_error
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b'{"jsonrpc":"2.0","id":1,"error":{"code":429,"message":"exceeded its compute units per second capacity"}}',
+        b'{"jsonrpc":"2.0","id":1,"error":{"code":-32005,"message":"daily request count exceeded, request rate limited"}}',
+        b'[{"jsonrpc":"2.0","id":1,"error":{"message":"project ID request rate exceeded","code":-32005}}]',
+    ],
+)
+def test_rate_limit_errors_throttle(content: bytes) -> None:
+    assert throttle_error(content)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b'{"jsonrpc":"2.0","id":1,"result":"0x"}',
+        b'{"jsonrpc":"2.0","id":1,"error":{"code":-32005,"message":"query returned more than 10000 results",'
+        b'"data":{"from":"0x1","limit":10000,"to":"0x2"}}}',
+        b'{"jsonrpc":"2.0","id":1,"error":{"code":-32000,"message":"execution reverted"}}',
+    ],
+)
+def test_other_errors_do_not_throttle(content: bytes) -> None:
+    assert not throttle_error(content)
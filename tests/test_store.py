@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+
+import store
+
+
+def entry(week: int, tvl: float) -> dict[str, float | int]:
+    return {"week": week, "year": 2026, "tvl_usd": tvl}
+
+
+def test_imports_legacy_json_once(data_dir: Path) -> None:
+    path = data_dir / "tvl_cache.json"
+    path.write_text(json.dumps([entry(1, 1.0), entry(2, 2.0)]))
+    assert store.history("tvl") == [entry(1, 1.0), entry(2, 2.0)]
+
+    # Edits to the JSON file after the import are not read back, and upserts leave the file alone
+    path.write_text(json.dumps([entry(1, 1.0)]))
+    store._migrated.clear()
+    store.upsert("tvl", entry(3, 3.0))
+    assert store.history("tvl") == [entry(1, 1.0), entry(2, 2.0), entry(3, 3.0)]
+    assert json.loads(path.read_text()) == [entry(1, 1.0)]
+
+
+def test_legacy_single_entry(data_dir: Path) -> None:
+    (data_dir / "yyb_cache.json").write_text(json.dumps(entry(3, 1.0)))
+    assert store.get("yyb", 2026, 3) == entry(3, 1.0)
+    assert store.get("yyb", 2026, 2) is None
+
+
+def test_upsert_replaces_week(data_dir: Path) -> None:
+    store.upsert("tvl", entry(52, 1.0))
+    store.upsert("tvl", entry(52, 2.0))
+    store.upsert("tvl", {**entry(1, 3.0), "year": 2027})
+    assert store.history("tvl") == [entry(52, 2.0), {**entry(1, 3.0), "year": 2027}]
+    assert store.latest("tvl", 2026) == entry(52, 2.0)
+    assert store.latest("tvl") == {**entry(1, 3.0), "year": 2027}
+
+
+def test_export(data_dir: Path) -> None:
+    store.upsert("tvl", entry(2, 2.0))
+    store.upsert("tvl", entry(1, 1.0))
+    store.export("tvl")
+    assert json.loads((data_dir / "tvl_cache.json").read_text()) == [entry(1, 1.0), entry(2, 2.0)]
+    assert (data_dir / "history.db").exists()
+
+
+def test_upsert_many(data_dir: Path) -> None:
+    store.upsert("tvl", entry(1, 1.0))
+    store.upsert_many("tvl", [entry(1, 2.0), entry(2, 2.0)])
+    store.upsert_many("tvl", [])
+    assert store.history("tvl") == [entry(1, 2.0), entry(2, 2.0)]